@@ -0,0 +1,389 @@
+import json
+import os
+import time
+
+import pandas as pd
+
+from fc_metric import (MODEL, PROMPT_TEMPLATE_VERSION, SINGLE_TOKEN_PARAMS, TEMPERATURE, build_messages,
+                       parse_logprob_score, parse_score, top_logprobs_content)
+from fc_planning import DedupPlan
+from fc_prompts import dumps
+from llm_telemetry import BATCH_DISCOUNT, Telemetry
+from response_cache import ResponseCache
+
+# Limits of a single Batch API input file
+MAX_REQUESTS_PER_FILE = 50_000
+MAX_BYTES_PER_FILE = 190 * 1024 * 1024
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def custom_id(row_number: int, post_id) -> str:
+    return f"row-{row_number}-fc-id-{post_id}"
+
+
+def parse_custom_id(value: str) -> (int, str):
+    _, row_number, _, _, post_id = value.split("-", 4)
+    return int(row_number), post_id
+
+
+def batch_request(row_number: int, post_id, messages: list, model: str = MODEL, params: dict = None) -> dict:
+    return {
+        "custom_id": custom_id(row_number, post_id),
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {"model": model, "messages": messages, "temperature": TEMPERATURE, **(params or {})},
+    }
+
+
+class OpenAIBatchBackend:
+    """
+    Batch API backend on top of an OpenAI client
+    """
+
+    def __init__(self, client=None):
+        self._client = client
+
+    @property
+    def client(self):
+        # Created on the first API call, so a resumed or fully cached run needs no credentials
+        if self._client is None:
+            from openai import OpenAI
+
+            self._client = OpenAI()
+        return self._client
+
+    def upload(self, path: str) -> str:
+        with open(path, "rb") as f:
+            return self.client.files.create(file=f, purpose="batch").id
+
+    def create(self, file_id: str) -> str:
+        return self.client.batches.create(
+            input_file_id=file_id, endpoint="/v1/chat/completions", completion_window="24h").id
+
+    def retrieve(self, batch_id: str) -> dict:
+        batch = self.client.batches.retrieve(batch_id)
+        return {"status": batch.status, "output_file_id": batch.output_file_id, "error_file_id": batch.error_file_id}
+
+    def download(self, file_id: str, path: str):
+        self.client.files.content(file_id).write_to_file(path)
+
+
+class FakeBatchBackend:
+    """
+    In-process stand-in for the Batch API. Every request is answered by `respond(body) -> content`,
+    a batch completes after `polls_until_done` retrievals. Requests with logprobs get the content as their only
+    top logprob.
+    """
+
+    def __init__(self, respond=lambda body: '{"score": 3}', polls_until_done: int = 1):
+        self.respond = respond
+        self.polls_until_done = polls_until_done
+        self.files = {}
+        self.batches = {}
+
+    def upload(self, path: str) -> str:
+        file_id = f"file-{len(self.files)}"
+        with open(path, "rb") as f:
+            self.files[file_id] = f.read()
+        return file_id
+
+    def create(self, file_id: str) -> str:
+        batch_id = f"batch-{len(self.batches)}"
+        self.batches[batch_id] = {"input_file_id": file_id, "polls": 0}
+        return batch_id
+
+    def retrieve(self, batch_id: str) -> dict:
+        batch = self.batches[batch_id]
+        batch["polls"] += 1
+        if batch["polls"] < self.polls_until_done:
+            return {"status": "in_progress", "output_file_id": None, "error_file_id": None}
+        if "output_file_id" not in batch:
+            lines = []
+            for line in self.files[batch["input_file_id"]].decode().splitlines():
+                request = json.loads(line)
+                content = self.respond(request["body"])
+                choice = {"message": {"role": "assistant", "content": content}}
+                if request["body"].get("logprobs"):
+                    choice["logprobs"] = {"content": [{"token": content, "logprob": 0.0,
+                                                       "top_logprobs": [{"token": content, "logprob": 0.0}]}]}
+                lines.append(json.dumps({
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": 200, "body": {"choices": [choice]}},
+                    "error": None,
+                }))
+            batch["output_file_id"] = f"file-{len(self.files)}"
+            self.files[batch["output_file_id"]] = ("\n".join(lines) + "\n").encode()
+        return {"status": "completed", "output_file_id": batch["output_file_id"], "error_file_id": None}
+
+    def download(self, file_id: str, path: str):
+        with open(path, "wb") as f:
+            f.write(self.files[file_id])
+
+
+class BatchRunner:
+    """
+    Shards a dataset into Batch API request files, submits them, polls, downloads and merges the scores
+    back by custom_id. Every step is recorded in <workdir>/manifest.json, so a run can be resumed after a
+    crash by calling run() again with the same workdir.
+    With a response_cache.ResponseCache, rows with a cached response are not sent and downloaded
+    responses are added to the cache.
+    With single_token, the requests ask for one score token with logprobs and the merged output has an
+    fc_expected_score column next to the score.
+    """
+
+    def __init__(self, backend, workdir: str, model: str = MODEL, max_requests: int = MAX_REQUESTS_PER_FILE,
+                 max_bytes: int = MAX_BYTES_PER_FILE, cache=None, single_token: bool = False, telemetry=None):
+        self.backend = backend
+        self.cache = cache
+        # Optional llm_telemetry.Telemetry (with discount=BATCH_DISCOUNT), records the usage of downloaded outputs
+        self.telemetry = telemetry
+        self.single_token = single_token
+        self._params = SINGLE_TOKEN_PARAMS if single_token else {}
+        self._failed = (-1, -1.0) if single_token else -1
+        self.workdir = workdir
+        self.model = model
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.manifest_path = os.path.join(workdir, "manifest.json")
+        os.makedirs(workdir, exist_ok=True)
+        self.manifest = self._load_manifest()
+
+    def _load_manifest(self) -> dict:
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        return {"shards": []}
+
+    def _save_manifest(self):
+        with open(self.manifest_path + ".tmp", "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(self.manifest_path + ".tmp", self.manifest_path)
+
+    def _messages(self, df: pd.DataFrame, abstract_column: str = "sem_scholar_abstract",
+                  summary_column: str = "title", title_column: str = "sem_scholar_title", id_column: str = "id"):
+        titles = df[title_column] if title_column in df.columns else pd.Series(None, index=df.index)
+        rows = zip(df[abstract_column], df[summary_column], titles, df[id_column])
+        for row_number, (abstract, summary, title, post_id) in enumerate(rows):
+            messages = build_messages(abstract, summary, title if pd.notna(title) else None, self.single_token)
+            yield row_number, post_id, messages
+
+    def _cache_key(self, messages: list) -> str:
+        return self.cache.key(self.model, messages, TEMPERATURE, PROMPT_TEMPLATE_VERSION)
+
+    def _content(self, body: dict) -> str:
+        """
+        The response content of a chat completion body, the serialized top logprobs with single_token
+        """
+        choice = body["choices"][0]
+        if self.single_token:
+            top_logprobs = choice["logprobs"]["content"][0]["top_logprobs"]
+            return top_logprobs_content((top["token"], top["logprob"]) for top in top_logprobs)
+        return choice["message"]["content"]
+
+    def _parse(self, content: str):
+        return parse_logprob_score(content) if self.single_token else parse_score(content)
+
+    def requests(self, df: pd.DataFrame, **columns):
+        """
+        One batch request per row, the custom_id holds the row number and post id.
+        Rows with a cached response are skipped.
+        :param columns: abstract_column, summary_column, title_column and id_column, if not the defaults
+        """
+        for row_number, post_id, messages in self._messages(df, **columns):
+            if self.cache is not None and self.cache.get(self._cache_key(messages)) is not None:
+                if self.telemetry is not None:
+                    self.telemetry.record_cache_hit()
+                continue
+            yield batch_request(row_number, post_id, messages, self.model, self._params)
+
+    def shard(self, requests, prefix: str = "requests") -> [dict]:
+        """
+        Write the requests to JSONL files that stay under the request count and size limits.
+        Does nothing if the manifest already has shards.
+        """
+        if self.manifest["shards"]:
+            return self.manifest["shards"]
+
+        shards = []
+        f = None
+        for request in requests:
+            line = dumps(request) + b"\n"
+            if f is None or shards[-1]["n_requests"] >= self.max_requests \
+                    or shards[-1]["n_bytes"] + len(line) > self.max_bytes:
+                if f is not None:
+                    f.close()
+                path = os.path.join(self.workdir, f"{prefix}_{len(shards):04d}.jsonl")
+                shards.append({"path": path, "n_requests": 0, "n_bytes": 0, "file_id": None, "batch_id": None,
+                               "status": "prepared", "output_path": None, "error_path": None})
+                f = open(path, "wb")
+            f.write(line)
+            shards[-1]["n_requests"] += 1
+            shards[-1]["n_bytes"] += len(line)
+        if f is not None:
+            f.close()
+
+        self.manifest["shards"] = shards
+        self._save_manifest()
+        return shards
+
+    def submit(self):
+        """
+        Upload and create a batch for every shard that was not submitted yet
+        """
+        for shard in self.manifest["shards"]:
+            if shard["file_id"] is None:
+                shard["file_id"] = self.backend.upload(shard["path"])
+                self._save_manifest()
+            if shard["batch_id"] is None:
+                shard["batch_id"] = self.backend.create(shard["file_id"])
+                shard["status"] = "submitted"
+                self._save_manifest()
+                print(f"Submitted {shard['path']} as {shard['batch_id']}")
+
+    def poll(self, interval: float = 60, timeout: float = None) -> bool:
+        """
+        Poll the submitted batches and download the outputs of finished ones until every shard is done
+        :return: True if every shard reached a terminal status
+        """
+        started = time.monotonic()
+        while True:
+            pending = [shard for shard in self.manifest["shards"] if shard["status"] not in TERMINAL_STATUSES]
+            for shard in pending:
+                batch = self.backend.retrieve(shard["batch_id"])
+                if batch["status"] in TERMINAL_STATUSES:
+                    base = shard["path"][:-len(".jsonl")]
+                    if batch["output_file_id"]:
+                        shard["output_path"] = base + "_output.jsonl"
+                        self.backend.download(batch["output_file_id"], shard["output_path"])
+                        self._record_outputs(shard)
+                    if batch["error_file_id"]:
+                        shard["error_path"] = base + "_errors.jsonl"
+                        self.backend.download(batch["error_file_id"], shard["error_path"])
+                    print(f"Batch {shard['batch_id']} {batch['status']}")
+                shard["status"] = batch["status"]
+                self._save_manifest()
+            if all(shard["status"] in TERMINAL_STATUSES for shard in self.manifest["shards"]):
+                return True
+            if timeout is not None and time.monotonic() - started > timeout:
+                return False
+            time.sleep(interval)
+
+    def _record_outputs(self, shard: dict):
+        """
+        Add the successful responses of a downloaded shard that parse to a score to the cache, keyed by the request
+        that produced them, and record their usage in the telemetry
+        """
+        if self.cache is None and self.telemetry is None:
+            return
+        bodies = {}
+        if self.cache is not None:
+            with open(shard["path"]) as f:
+                bodies = {request["custom_id"]: request["body"] for request in map(json.loads, f)}
+        items = []
+        with open(shard["output_path"]) as f:
+            for output in map(json.loads, f):
+                response = output.get("response") or {}
+                ok = response.get("status_code") == 200
+                if self.telemetry is not None:
+                    self.telemetry.record_call(usage=(response.get("body") or {}).get("usage"), error=not ok)
+                if ok and self.cache is not None:
+                    try:
+                        content = self._content(response["body"])
+                        valid = self._parse(content) != self._failed
+                    except Exception:
+                        # results() reports the failure, the row is requested again after a restart
+                        valid = False
+                    if valid:
+                        items.append((self._cache_key(bodies[output["custom_id"]]["messages"]), content))
+        if self.cache is not None:
+            self.cache.put_many(items)
+
+    def retry_failed(self):
+        """
+        Reset failed, expired and cancelled shards so that the next submit() sends them again
+        """
+        for shard in self.manifest["shards"]:
+            if shard["status"] in TERMINAL_STATUSES - {"completed"}:
+                shard.update(file_id=None, batch_id=None, status="prepared", output_path=None, error_path=None)
+        self._save_manifest()
+
+    def results(self) -> dict:
+        """
+        Scores of every downloaded response, by custom_id (-1 if the response could not be parsed).
+        With single_token, (score, expected score) pairs.
+        """
+        scores = {}
+        for shard in self.manifest["shards"]:
+            if not shard["output_path"]:
+                continue
+            with open(shard["output_path"]) as f:
+                for line in f:
+                    output = json.loads(line)
+                    try:
+                        scores[output["custom_id"]] = self._parse(self._content(output["response"]["body"]))
+                    except Exception as e:
+                        print(f"Error: {e} for {output['custom_id']}, returning -1")
+                        scores[output["custom_id"]] = self._failed
+                        if self.telemetry is not None:
+                            self.telemetry.record_parse_failure()
+        return scores
+
+    def merge(self, df: pd.DataFrame, score_column: str = "fc_score", **columns) -> pd.DataFrame:
+        """
+        Write the scores into a copy of the DataFrame the requests were built from, -1 for rows without a result.
+        Rows that were skipped because of a cached response get the cached score.
+        :param columns: abstract_column, summary_column, title_column and id_column, if not the defaults
+        """
+        df_out = df.copy()
+        scores = [self._failed] * len(df)
+        if self.cache is not None:
+            for row_number, _, messages in self._messages(df, **columns):
+                content = self.cache.get(self._cache_key(messages))
+                if content is not None:
+                    try:
+                        scores[row_number] = self._parse(content)
+                    except Exception as e:
+                        print(f"Error: {e} for cached response: {content}, returning -1")
+        post_ids = df[columns.get("id_column", "id")].tolist()
+        for key, score in self.results().items():
+            row_number, post_id = parse_custom_id(key)
+            if str(post_ids[row_number]) != post_id:
+                raise ValueError(f"Row ID {row_number} does not match post ID {post_id}")
+            scores[row_number] = score
+        if self.single_token:
+            df_out[score_column] = [score for score, _ in scores]
+            df_out["fc_expected_score"] = [expected for _, expected in scores]
+        else:
+            df_out[score_column] = scores
+        return df_out
+
+    def run(self, df: pd.DataFrame, interval: float = 60, **request_kwargs) -> pd.DataFrame:
+        """
+        Shard, submit, poll and merge. Safe to call again after a crash with the same workdir.
+        """
+        if self.telemetry is not None:
+            self.telemetry.record_rows(len(df))
+        self.shard(self.requests(df, **request_kwargs))
+        self.submit()
+        self.poll(interval)
+        return self.merge(df, **request_kwargs)
+
+
+if __name__ == "__main__":
+    abstracts_file_name = "scientific_nature_DOIs"
+    df = pd.read_csv(f"../data/identifiers_and_abstracts/{abstracts_file_name}.csv")
+    df.dropna(subset=["sem_scholar_abstract"], inplace=True, ignore_index=True)
+    # Reposts of the same paper with the same title are only sent once
+    plan = DedupPlan(df)
+    print(plan.report())
+    telemetry = Telemetry(f"fc_batch_{abstracts_file_name}", discount=BATCH_DISCOUNT)
+    # Responses of earlier runs are reused, rows that are all cached are not sent again
+    os.makedirs("batches", exist_ok=True)
+    cache = ResponseCache("batches/responses.sqlite")
+    runner = BatchRunner(OpenAIBatchBackend(), f"batches/{abstracts_file_name}", cache=cache, telemetry=telemetry)
+    df_out = df.copy()
+    df_out["fc_score"] = plan.broadcast(runner.run(plan.unique)["fc_score"])
+    # Rows answered by deduplication count towards the cost per row as well
+    telemetry.record_rows(plan.n_rows - plan.n_unique)
+    df_out.to_csv(f"{abstracts_file_name}_fc_scores.csv", index=False)
+    telemetry.write_report(f"batches/{abstracts_file_name}/telemetry")
@@ -0,0 +1,327 @@
+import asyncio
+import random
+import time
+
+import openai
+import pandas as pd
+from openai import AsyncOpenAI
+
+from fc_metric import (MODEL, PROMPT_TEMPLATE_VERSION, SINGLE_TOKEN_PARAMS, TEMPERATURE, build_messages,
+                       build_packed_messages, parse_logprob_score, parse_packed_scores, parse_score,
+                       top_logprobs_content)
+from fc_planning import score_deduplicated_async
+
+# Status codes that are worth retrying
+RETRY_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Token bucket that refills `rate` units per minute, up to `rate` units
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.capacity = rate
+        self.available = rate
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate / 60)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1):
+        """
+        Wait until `amount` units are available and take them. Requests larger than the bucket
+        wait for a full bucket.
+        """
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self.available < amount:
+                await asyncio.sleep((amount - self.available) * 60 / self.rate)
+                self._refill()
+            self.available -= amount
+
+    def adjust(self, amount: float):
+        """
+        Give back (negative amount) or take extra units once the real usage is known
+        """
+        self._refill()
+        self.available = min(self.capacity, self.available - amount)
+
+
+def estimate_tokens(messages: list, max_completion_tokens: int = 16) -> int:
+    """
+    Rough token count of a request (4 characters per token) plus the expected completion
+    """
+    return sum(len(message["content"]) for message in messages) // 4 + max_completion_tokens
+
+
+def _retry_after(error: Exception):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _should_retry(error: Exception) -> bool:
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code in RETRY_STATUS_CODES
+
+
+def require_no_running_loop(name: str, alternative: str):
+    """
+    Raise a RuntimeError that points to the coroutine to await if an event loop is already running
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    raise RuntimeError(f"{name} runs its own event loop and cannot be called where one is already running "
+                       f"(e.g. Jupyter), await {alternative} instead")
+
+
+class AsyncFCScorer:
+    """
+    Scores (abstract, reddit title, research title) triples concurrently against the chat completions endpoint,
+    with a bound on in-flight requests, token buckets for requests/min and tokens/min, and retries with
+    jittered exponential backoff on 429/5xx.
+    With single_token, the model answers with one score token and every score is a (score, expected score) pair
+    computed from its logprobs.
+    """
+
+    def __init__(self, client: AsyncOpenAI = None, model: str = MODEL, concurrency: int = 32,
+                 requests_per_minute: float = 5_000, tokens_per_minute: float = 2_000_000, max_retries: int = 6,
+                 backoff_base: float = 1.0, backoff_cap: float = 60.0, fail_silent: bool = True, cache=None,
+                 single_token: bool = False, telemetry=None):
+        # Created on the first live request (see _get_client), so runs served from the cache need no credentials
+        self.client = client
+        self.model = model
+        self.concurrency = concurrency
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.fail_silent = fail_silent
+        # Optional response_cache.ResponseCache, checked before any request is sent
+        self.cache = cache
+        self.single_token = single_token
+        self._params = SINGLE_TOKEN_PARAMS if single_token else {}
+        # Optional llm_telemetry.Telemetry, records every attempt, retry, cache hit and parse failure
+        self.telemetry = telemetry
+
+    def _get_client(self) -> AsyncOpenAI:
+        if self.client is None:
+            # Retries are handled here so that they also go through the rate limits
+            self.client = AsyncOpenAI(max_retries=0)
+        return self.client
+
+    async def _create(self, messages: list, max_completion_tokens: int = None):
+        client = self._get_client()
+        estimate = estimate_tokens(messages, max_completion_tokens or (1 if self.single_token else 16))
+        for attempt in range(self.max_retries + 1):
+            await self.requests.acquire()
+            await self.tokens.acquire(estimate)
+            started = time.perf_counter()
+            try:
+                response = await client.chat.completions.create(
+                    messages=messages, model=self.model, temperature=TEMPERATURE, **self._params)
+            except Exception as e:
+                if self.telemetry is not None:
+                    self.telemetry.record_call(time.perf_counter() - started, error=True)
+                if attempt == self.max_retries or not _should_retry(e):
+                    raise
+                if self.telemetry is not None:
+                    self.telemetry.record_retry()
+                backoff = min(self.backoff_cap, self.backoff_base * 2 ** attempt)
+                await asyncio.sleep(_retry_after(e) or random.uniform(0, backoff))
+                continue
+            if self.telemetry is not None:
+                self.telemetry.record_call(time.perf_counter() - started, response.usage)
+            if response.usage is not None:
+                self.tokens.adjust(response.usage.total_tokens - estimate)
+            return response
+
+    def _cached(self, messages: list):
+        """
+        The cache key of the messages and the cached response content, (None, None) without a cache
+        """
+        if self.cache is None:
+            return None, None
+        key = self.cache.key(self.model, messages, TEMPERATURE, PROMPT_TEMPLATE_VERSION)
+        content = self.cache.get(key)
+        if content is not None and self.telemetry is not None:
+            self.telemetry.record_cache_hit()
+        return key, content
+
+    def _parse_failure(self):
+        if self.telemetry is not None:
+            self.telemetry.record_parse_failure()
+
+    def _content(self, response) -> str:
+        if self.single_token:
+            top_logprobs = response.choices[0].logprobs.content[0].top_logprobs
+            return top_logprobs_content((top.token, top.logprob) for top in top_logprobs)
+        return response.choices[0].message.content
+
+    async def score(self, original_text, summary_text, original_title=None):
+        """
+        Score a single triple, -1 (or (-1, -1.0) with single_token) if the request or parsing fails
+        and fail_silent is set
+        """
+        messages = build_messages(original_text, summary_text, original_title, self.single_token)
+        key, gpt_score_json = self._cached(messages)
+        cached = gpt_score_json is not None
+        if not cached:
+            # Outside the try, so missing credentials raise even with fail_silent
+            self._get_client()
+        try:
+            if gpt_score_json is None:
+                response = await self._create(messages)
+                gpt_score_json = self._content(response)
+            score = parse_logprob_score(gpt_score_json) if self.single_token else parse_score(gpt_score_json)
+            if score in (-1, (-1, -1.0)):
+                self._parse_failure()
+            elif not cached and self.cache is not None:
+                # Only valid responses are cached, so a failed row is requested again when it is retried
+                self.cache.put(key, gpt_score_json)
+            return score
+        except Exception as e:
+            if gpt_score_json is not None:
+                self._parse_failure()
+            if not self.fail_silent:
+                raise e
+            print(f"Error: {e} for response: {gpt_score_json}, returning -1")
+            return (-1, -1.0) if self.single_token else -1
+
+    async def score_packed(self, original_text, summary_texts: list, original_title=None) -> [int]:
+        """
+        Score several summaries of the same abstract in one request, so the abstract is only sent once.
+        Items that do not parse, or all of them if the response is not an array of the right length,
+        are scored with single-summary requests.
+        """
+        if self.single_token:
+            raise ValueError("Packed requests need the JSON answer format, not single_token")
+        if len(summary_texts) == 1:
+            return [await self.score(original_text, summary_texts[0], original_title)]
+
+        messages = build_packed_messages(original_text, summary_texts, original_title)
+        key, content = self._cached(messages)
+        if content is None:
+            self._get_client()
+        scores = [None] * len(summary_texts)
+        try:
+            if content is None:
+                response = await self._create(messages, 4 * len(summary_texts) + 8)
+                content = response.choices[0].message.content
+            scores = parse_packed_scores(content, len(summary_texts))
+            if None in scores:
+                self._parse_failure()
+            elif self.cache is not None:
+                self.cache.put(key, content)
+        except Exception as e:
+            if content is not None:
+                self._parse_failure()
+            print(f"Error: {e} for packed response: {content}, falling back to single requests")
+
+        retry = [i for i, score in enumerate(scores) if score is None]
+        fallback = await asyncio.gather(*(self.score(original_text, summary_texts[i], original_title) for i in retry))
+        for i, score in zip(retry, fallback):
+            scores[i] = score
+        return scores
+
+    async def score_packed_pairs(self, pairs, pack_size: int = 8) -> [int]:
+        """
+        Score an iterable of (original_text, summary_text[, original_title]) tuples, packing up to pack_size
+        summaries of the same (original_text, original_title) into one request
+        :return: The scores, aligned with the input
+        """
+        groups = {}
+        n = 0
+        for n, pair in enumerate(pairs, 1):
+            original_text, summary_text, original_title = (tuple(pair) + (None,))[:3]
+            groups.setdefault((original_text, original_title), []).append((n - 1, summary_text))
+        packs = [(original_text, original_title, members[start:start + pack_size])
+                 for (original_text, original_title), members in groups.items()
+                 for start in range(0, len(members), pack_size)]
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def bounded(original_text, original_title, members):
+            async with semaphore:
+                return await self.score_packed(original_text, [summary for _, summary in members], original_title)
+
+        scores = [-1] * n
+        for (_, _, members), pack_scores in zip(packs, await asyncio.gather(*(bounded(*pack) for pack in packs))):
+            for (i, _), score in zip(members, pack_scores):
+                scores[i] = score
+        return scores
+
+    async def score_pairs(self, pairs) -> [int]:
+        """
+        Score an iterable of (original_text, summary_text[, original_title]) tuples
+        :return: The scores, aligned with the input
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def bounded(pair):
+            async with semaphore:
+                return await self.score(*pair)
+
+        return await asyncio.gather(*(bounded(pair) for pair in pairs))
+
+
+async def score_dataframe_async(df: pd.DataFrame, abstract_column: str = "sem_scholar_abstract",
+                                summary_column: str = "title", title_column: str = "sem_scholar_title",
+                                deduplicate: bool = True, pack_size: int = 1, **scorer_kwargs):
+    """
+    Score every row of the DataFrame with AsyncFCScorer on the running event loop, e.g.
+    `scores = await score_dataframe_async(df)` in a notebook
+    :param deduplicate: If True, score every unique (abstract, title, summary) triple once
+    :param pack_size: If above 1, score up to pack_size summaries of the same abstract per request
+    :return: The fc scores as a Series aligned with the rows of the DataFrame. With single_token=True a DataFrame
+    with the fc_score and fc_expected_score columns.
+    """
+    if scorer_kwargs.get("telemetry") is not None:
+        scorer_kwargs["telemetry"].record_rows(len(df))
+    if deduplicate:
+        return await score_deduplicated_async(
+            df, lambda unique: _score_rows(unique, abstract_column, summary_column, title_column, pack_size,
+                                           **scorer_kwargs),
+            abstract_column, summary_column, title_column)
+    return await _score_rows(df, abstract_column, summary_column, title_column, pack_size, **scorer_kwargs)
+
+
+def score_dataframe(df: pd.DataFrame, abstract_column: str = "sem_scholar_abstract", summary_column: str = "title",
+                    title_column: str = "sem_scholar_title", deduplicate: bool = True, pack_size: int = 1,
+                    **scorer_kwargs):
+    """
+    score_dataframe_async for scripts and the command line. It starts its own event loop, so it raises a
+    RuntimeError where a loop is already running (Jupyter), await score_dataframe_async there instead.
+    """
+    require_no_running_loop("score_dataframe", "score_dataframe_async")
+    return asyncio.run(score_dataframe_async(df, abstract_column, summary_column, title_column, deduplicate,
+                                             pack_size, **scorer_kwargs))
+
+
+async def _score_rows(df: pd.DataFrame, abstract_column: str, summary_column: str, title_column: str,
+                      pack_size: int, **scorer_kwargs):
+    titles = df[title_column] if title_column in df.columns else pd.Series(None, index=df.index)
+    titles = titles.astype(object).where(titles.notna(), None)
+    pairs = zip(df[abstract_column], df[summary_column], titles)
+
+    scorer = AsyncFCScorer(**scorer_kwargs)
+    if pack_size > 1:
+        scores = await scorer.score_packed_pairs(pairs, pack_size)
+    else:
+        scores = await scorer.score_pairs(pairs)
+    if scorer_kwargs.get("single_token"):
+        return pd.DataFrame(scores, index=df.index, columns=["fc_score", "fc_expected_score"])
+    return pd.Series(scores, index=df.index, name="fc_score")
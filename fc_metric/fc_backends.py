@@ -0,0 +1,262 @@
+import argparse
+import asyncio
+import os
+import string
+import time
+
+import pandas as pd
+
+from fc_metric import MODEL
+from fc_planning import score_deduplicated, score_deduplicated_async
+
+# Backends:
+#   gpt: the chat completions prompt of fc_metric, scored remotely (1 to 5)
+#   nli: a local transformers NLI/cross-encoder model, the entailment probability of the reddit title given the
+#        research title and abstract mapped to 1 to 5
+BACKENDS = ('gpt', 'nli')
+DEFAULT_BACKEND = os.getenv('FC_BACKEND', 'gpt')
+NLI_MODEL = os.getenv('FC_NLI_MODEL', 'cross-encoder/nli-deberta-v3-small')
+
+
+class GPTBackend:
+    """
+    Scores (abstract, reddit title, research title) triples with AsyncFCScorer
+    """
+    name = 'gpt'
+
+    def __init__(self, telemetry=None, **scorer_kwargs):
+        self.model_name = scorer_kwargs.get("model", MODEL)
+        self.telemetry = telemetry
+        self.scorer_kwargs = scorer_kwargs
+        # One scorer for all calls, so the rate limits hold across the chunks of a run. score_pairs runs it on one
+        # event loop of the backend, so the client's connections stay on the loop they were opened on
+        self._loop = None
+        self._scorer = None
+
+    def _get_scorer(self):
+        from fc_async import AsyncFCScorer
+
+        if self._scorer is None:
+            self._scorer = AsyncFCScorer(**self.scorer_kwargs)
+        # The telemetry can be replaced between calls (fc_runner.score_csv sets it for a report)
+        self._scorer.telemetry = self.telemetry
+        return self._scorer
+
+    async def score_pairs_async(self, pairs) -> list:
+        """
+        Score the pairs on the running event loop, e.g. `await backend.score_pairs_async(pairs)` in a notebook.
+        Use either this or score_pairs with one backend, the client's connections belong to the loop that opened them.
+        """
+        return await self._get_scorer().score_pairs(pairs)
+
+    def score_pairs(self, pairs) -> list:
+        """
+        score_pairs_async on the event loop of the backend, for scripts and the command line. Raises a RuntimeError
+        where a loop is already running (Jupyter).
+        """
+        from fc_async import require_no_running_loop
+
+        require_no_running_loop("GPTBackend.score_pairs", "score_pairs_async or score_dataframe_async")
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(self.score_pairs_async(pairs))
+
+    async def aclose(self):
+        if self._scorer is not None and self._scorer.client is not None:
+            await self._scorer.client.close()
+        self._scorer = None
+
+    def close(self):
+        if self._loop is not None:
+            self._loop.run_until_complete(self.aclose())
+            self._loop.close()
+            self._loop = None
+
+
+class NLIBackend:
+    """
+    Scores (abstract, reddit title, research title) triples with a sequence classification model on CPU.
+    The research title and abstract are the premise, the reddit title is the hypothesis. Batches are built from
+    length-sorted pairs and padded to their longest pair only.
+    """
+    name = 'nli'
+
+    def __init__(self, model_name: str = NLI_MODEL, batch_size: int = 32, max_length: int = 512,
+                 quantize: bool = False, num_threads: int = None, entailment_label: str = 'entailment',
+                 telemetry=None):
+        import torch
+        from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModelForSequenceClassification.from_pretrained(model_name).eval()
+        if quantize:
+            self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.model_name = model_name
+        # Optional llm_telemetry.Telemetry, every batch is recorded as a call
+        self.telemetry = telemetry
+
+        config = self.model.config
+        if config.num_labels == 1:
+            # Single logit cross-encoders give the consistency directly
+            self.entailment_id = None
+        else:
+            label2id = {label.lower(): i for label, i in config.label2id.items()}
+            if entailment_label not in label2id:
+                raise ValueError(f"Model {model_name} has no {entailment_label} label, only {list(label2id)}")
+            self.entailment_id = label2id[entailment_label]
+
+    def entailment(self, premises: [str], hypotheses: [str]) -> [float]:
+        """
+        Probability that each hypothesis follows from its premise
+        """
+        order = sorted(range(len(premises)), key=lambda i: len(premises[i]) + len(hypotheses[i]))
+        probabilities = [0.0] * len(premises)
+        with self.torch.inference_mode():
+            for start in range(0, len(order), self.batch_size):
+                batch = order[start:start + self.batch_size]
+                inputs = self.tokenizer([premises[i] for i in batch], [hypotheses[i] for i in batch],
+                                        padding=True, truncation='only_first', max_length=self.max_length,
+                                        return_tensors='pt')
+                started = time.perf_counter()
+                logits = self.model(**inputs).logits
+                if self.telemetry is not None:
+                    self.telemetry.record_call(time.perf_counter() - started)
+                if self.entailment_id is None:
+                    batch_probabilities = logits[:, 0].sigmoid()
+                else:
+                    batch_probabilities = logits.softmax(-1)[:, self.entailment_id]
+                for i, probability in zip(batch, batch_probabilities.tolist()):
+                    probabilities[i] = probability
+        return probabilities
+
+    def score_pairs(self, pairs) -> [float]:
+        premises, hypotheses = [], []
+        for pair in pairs:
+            original_text, summary_text, original_title = (tuple(pair) + (None,))[:3]
+            premises.append(f"{original_title}. {original_text}" if original_title else str(original_text))
+            hypotheses.append(str(summary_text))
+        return [1 + 4 * probability for probability in self.entailment(premises, hypotheses)]
+
+    async def score_pairs_async(self, pairs) -> [float]:
+        """
+        score_pairs on a worker thread, so the running event loop is not blocked by the model
+        """
+        return await asyncio.to_thread(self.score_pairs, list(pairs))
+
+
+def get_backend(name: str = None, **kwargs):
+    """
+    The fc backend by name, FC_BACKEND (gpt by default) if not given
+    :param kwargs: Passed to the backend, e.g. quantize=True for nli or concurrency=64 for gpt
+    """
+    name = name or DEFAULT_BACKEND
+    if name == 'gpt':
+        return GPTBackend(**kwargs)
+    if name == 'nli':
+        return NLIBackend(**kwargs)
+    raise ValueError(f"Unknown fc backend {name}, choose one of {BACKENDS}")
+
+
+def _resolve_backend(df: pd.DataFrame, backend):
+    if backend is None or isinstance(backend, str):
+        backend = get_backend(backend)
+    if backend.telemetry is not None:
+        backend.telemetry.record_rows(len(df))
+    return backend
+
+
+def _pairs(unique: pd.DataFrame, abstract_column: str, summary_column: str, title_column: str):
+    titles = unique[title_column] if title_column in unique.columns else [None] * len(unique)
+    return zip(unique[abstract_column], unique[summary_column], titles)
+
+
+def score_dataframe(df: pd.DataFrame, backend=None, abstract_column: str = "sem_scholar_abstract",
+                    summary_column: str = "title", title_column: str = "sem_scholar_title") -> pd.Series:
+    """
+    Score every unique (abstract, title, summary) triple of the DataFrame once with the backend.
+    For scripts and the command line, the gpt backend raises a RuntimeError where an event loop is already running
+    (Jupyter), await score_dataframe_async there instead.
+    :param backend: A backend instance or name, FC_BACKEND if not given
+    :return: The fc scores as a Series aligned with the rows of the DataFrame
+    """
+    backend = _resolve_backend(df, backend)
+    return score_deduplicated(
+        df, lambda unique: backend.score_pairs(_pairs(unique, abstract_column, summary_column, title_column)),
+        abstract_column, summary_column, title_column)
+
+
+async def score_dataframe_async(df: pd.DataFrame, backend=None, abstract_column: str = "sem_scholar_abstract",
+                                summary_column: str = "title", title_column: str = "sem_scholar_title") -> pd.Series:
+    """
+    score_dataframe on the running event loop, e.g. `scores = await score_dataframe_async(df, backend)` in a notebook
+    """
+    backend = _resolve_backend(df, backend)
+    return await score_deduplicated_async(
+        df, lambda unique: backend.score_pairs_async(_pairs(unique, abstract_column, summary_column, title_column)),
+        abstract_column, summary_column, title_column)
+
+
+def make_tiny_nli_model(path: str, seed: int = 0) -> str:
+    """
+    Save a tiny randomly initialized BERT NLI model with a character vocabulary, for offline runs of the
+    nli backend. Its scores are meaningless.
+    :return: The path, to pass as model_name
+    """
+    import torch
+    from transformers import BertConfig, BertForSequenceClassification, BertTokenizer
+
+    os.makedirs(path, exist_ok=True)
+    characters = string.ascii_lowercase + string.digits
+    vocab = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + list(characters) + [f"##{c}" for c in characters] \
+        + list(string.punctuation)
+    vocab_file = os.path.join(path, 'vocab.txt')
+    with open(vocab_file, 'w') as f:
+        f.write('\n'.join(vocab) + '\n')
+
+    torch.manual_seed(seed)
+    labels = ['entailment', 'neutral', 'contradiction']
+    config = BertConfig(vocab_size=len(vocab), hidden_size=32, num_hidden_layers=2, num_attention_heads=2,
+                        intermediate_size=64, max_position_embeddings=512, num_labels=len(labels),
+                        id2label=dict(enumerate(labels)), label2id={label: i for i, label in enumerate(labels)})
+    BertForSequenceClassification(config).save_pretrained(path)
+    BertTokenizer(vocab_file).save_pretrained(path)
+    return path
+
+
+def benchmark(backend, pairs: list) -> float:
+    """
+    Rows per second of the backend on the pairs
+    """
+    started = time.perf_counter()
+    backend.score_pairs(pairs)
+    return len(pairs) / (time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the fc backends in rows/second")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--rows", type=int, default=512)
+    parser.add_argument("--model", default=NLI_MODEL, help="NLI model name or path")
+    parser.add_argument("--tiny", action="store_true", help="Use a tiny random NLI model (offline)")
+    parser.add_argument("--quantize", action="store_true", help="int8 dynamic quantization of the NLI model")
+    parser.add_argument("--base-url", help="Chat completions base URL for gpt, e.g. the stub_server")
+    args = parser.parse_args()
+
+    df = pd.read_csv("../data/mocked_fc_data.csv")
+    pairs = list(zip(df["research_abstract"], df["reddit_post"]))
+    pairs = (pairs * (args.rows // len(pairs) + 1))[:args.rows]
+
+    for name in args.backends:
+        if name == 'nli':
+            model = make_tiny_nli_model("tiny_nli_model") if args.tiny else args.model
+            backend = NLIBackend(model, quantize=args.quantize)
+        else:
+            from openai import AsyncOpenAI
+
+            backend = GPTBackend(client=AsyncOpenAI(base_url=args.base_url, max_retries=0))
+        print(f"{name}: {benchmark(backend, pairs):.1f} rows/s")
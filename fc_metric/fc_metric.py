@@ -1,17 +1,121 @@
+import json
+import math
 import os
 
-import pandas as pd
-from openai import OpenAI
+from fc_prompts import render_messages, render_packed_messages
+from llm_telemetry import timed_call
 
-if not os.getenv("OPENAI_API_KEY"):
-    raise ValueError(
-        "Please set the OPENAI_API_KEY environment variable before running the factual consistency metric script"
-    )
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+MODEL = "gpt-4o-mini"
+TEMPERATURE = 0
+# Bump when the prompt changes, so cached responses of the old prompt are not reused
+PROMPT_TEMPLATE_VERSION = "1"
+# Single token mode: the answer is one score token, scored from its top logprobs
+SCORE_TOKENS = ("1", "2", "3", "4", "5")
+TOP_LOGPROBS = 10
+SINGLE_TOKEN_PARAMS = {"max_tokens": 1, "logprobs": True, "top_logprobs": TOP_LOGPROBS}
+
+_client = None
+
+
+def get_client():
+    """
+    The OpenAI client, created on the first live call so that importing this module needs no credentials
+    """
+    global _client
+    if _client is None:
+        if not os.getenv("OPENAI_API_KEY"):
+            raise ValueError(
+                "Please set the OPENAI_API_KEY environment variable before running the factual consistency metric script"
+            )
+        from openai import OpenAI
+
+        _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    return _client
+
+
+def __getattr__(name):
+    # fc_metric.client used to be created at import time
+    if name == "client":
+        return get_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def build_messages(original_text, summary_text, original_title=None, single_token=False) -> list:
+    """
+    Build the chat messages of the factual consistency prompt
+    :param original_text: The original text to compare against
+    :param summary_text: The summary text to evaluate
+    :param original_title: The original title
+    :param single_token: If True, ask for the bare score digit instead of a JSON object
+    :return: The messages for the chat completions endpoint
+    """
+    return render_messages(original_text, summary_text, original_title, single_token)
+
+
+def parse_score(gpt_score_json: str) -> int:
+    """
+    Parse the score out of the model response
+    :param gpt_score_json: The response content, e.g. '{"score": 4}'
+    :return: The score (-1 if the response has no score)
+    """
+    return int(json.loads(gpt_score_json).get("score", -1))
+
+
+def build_packed_messages(original_text, summary_texts: list, original_title=None) -> list:
+    """
+    Build the chat messages of a factual consistency prompt that scores several summaries of the same abstract
+    :param original_text: The original text to compare against
+    :param summary_texts: The summary texts to evaluate, numbered from 1 in the prompt
+    :param original_title: The original title
+    :return: The messages for the chat completions endpoint
+    """
+    return render_packed_messages(original_text, summary_texts, original_title)
+
+
+def parse_packed_scores(content: str, n: int) -> list:
+    """
+    Parse the scores of a packed prompt
+    :param content: The response content, e.g. '[4, 2, 5]'
+    :param n: The number of summaries in the prompt
+    :return: One score per summary, None for items that are not a score from 1 to 5
+    :raises ValueError: If the response is not a JSON array of n items
+    """
+    scores = json.loads(content)
+    if not isinstance(scores, list) or len(scores) != n:
+        raise ValueError(f"Expected a JSON array of {n} scores, got {content!r}")
+    return [score if isinstance(score, int) and not isinstance(score, bool) and 1 <= score <= 5 else None
+            for score in scores]
+
+
+def top_logprobs_content(top_logprobs) -> str:
+    """
+    Serialize the top logprobs of the score token, so that they can be cached like a response content
+    :param top_logprobs: (token, logprob) pairs
+    """
+    return json.dumps({token: logprob for token, logprob in top_logprobs})
+
+
+def parse_logprob_score(content: str) -> (int, float):
+    """
+    Score from the serialized top logprobs of the score token
+    :param content: The output of top_logprobs_content
+    :return: The most likely score and the probability weighted expected score, renormalized over the
+    score tokens ((-1, -1.0) if no score token is among the top logprobs)
+    """
+    probabilities = {}
+    for token, logprob in json.loads(content).items():
+        token = token.strip()
+        if token in SCORE_TOKENS:
+            probabilities[int(token)] = probabilities.get(int(token), 0.0) + math.exp(logprob)
+    total = sum(probabilities.values())
+    if not total:
+        return -1, -1.0
+    return max(probabilities, key=probabilities.get), sum(s * p for s, p in probabilities.items()) / total
 
 
 def calculate_fc_using_gpt(
-    original_text, summary_text, original_title: None, fail_silent=True, return_prompt=False
+    original_text, summary_text, original_title: None, fail_silent=True, return_prompt=False, cache=None,
+    telemetry=None
 ) -> int:
     """
     Calculate the factual consistency score using GPT-4o-mini
@@ -19,62 +123,106 @@ def calculate_fc_using_gpt(
     :param summary_text: The summary text to evaluate
     :param original_title: The original title
     :param fail_silent: If True, return -1 if an error occurs, otherwise raise the error
+    :param cache: Optional response_cache.ResponseCache, checked before calling the API
+    :param telemetry: Optional llm_telemetry.Telemetry that records the call
     :return: The factual consistency score as an integer 0 to 100 (-1 if an error occurs)
 
     """
-    taskins = "reddit post summarization given the referenced research abstract"
-    aspect = "factual consistency or identical titles"
-    antaspect = "inconsistencies or statements that can't be inferred"
-    aspectins = "the degree to which the reddit summary can be inferred from the research abstract"
-
+    messages = build_messages(original_text, summary_text, original_title)
+    if return_prompt:
+        return messages
+    if telemetry is not None:
+        telemetry.record_rows()
+    key = cache.key(MODEL, messages, TEMPERATURE, PROMPT_TEMPLATE_VERSION) if cache is not None else None
+    gpt_score_json = cache.get(key) if cache is not None else None
+    # Only a live call needs the client and credentials, a missing key raises even with fail_silent
+    client = get_client() if gpt_score_json is None else None
     try:
-        prompt = (
-            f'''Score the following {taskins} with respect to {aspect} on a discrete scale from 1 to 5, 
-where a score of 1 means “{antaspect}” and score of one 5 means “perfect {aspect}”. 
-Note that  {aspect} measures {aspectins}. 
-{f"Research Title: {original_title}" if original_title else ""}
-Research Abstract: {original_text}
-Reddit Summary: {summary_text}  
-Respond in the following format: '''
-            + '{"score": *insert score here*}'
-        )
-        messages = [
-                {
-                    "role": "system",
-                    "content": "You are an expert evaluator of scientific reddit posts.",
-                },
-                {"role": "user", "content": prompt},
-            ]
-
-        if return_prompt:
-            return messages
-        response = client.chat.completions.create(
-            messages=messages,
-            model="gpt-4o-mini",
-            temperature=0,
-        )
-
-        gpt_score_json = response.choices[0].message.content
-        gpt_score = eval(gpt_score_json).get("score", -1)
+        if gpt_score_json is None:
+            with timed_call(telemetry) as call:
+                call.response = response = client.chat.completions.create(
+                    messages=messages,
+                    model=MODEL,
+                    temperature=TEMPERATURE,
+                )
+            gpt_score_json = response.choices[0].message.content
+        elif telemetry is not None:
+            telemetry.record_cache_hit()
+        gpt_score = parse_score(gpt_score_json)
         # print(f"GPT Score: {gpt_score}")
-        return int(gpt_score)
+        if gpt_score == -1:
+            if telemetry is not None:
+                telemetry.record_parse_failure()
+        elif client is not None and cache is not None:
+            # Only valid responses are cached, so a failed row is requested again when it is retried
+            cache.put(key, gpt_score_json)
+        return gpt_score
     except Exception as e:
+        if gpt_score_json is not None and telemetry is not None:
+            telemetry.record_parse_failure()
         if not fail_silent:
             raise e
         print(
-            f"Error: {e} for the following prompt: {prompt}, response: {gpt_score_json}, returning -1"
+            f"Error: {e} for the following prompt: {messages}, response: {gpt_score_json}, returning -1"
         )
         return -1
 
 
+def calculate_fc_using_logprobs(
+    original_text, summary_text, original_title=None, fail_silent=True, cache=None, telemetry=None
+) -> (int, float):
+    """
+    Calculate the factual consistency score from the logprobs of a single score token.
+    Uses one output token per call and gives a continuous score next to the discrete one.
+    :param original_text: The original text to compare against
+    :param summary_text: The summary text to evaluate
+    :param original_title: The original title
+    :param fail_silent: If True, return (-1, -1.0) if an error occurs, otherwise raise the error
+    :param cache: Optional response_cache.ResponseCache, checked before calling the API
+    :param telemetry: Optional llm_telemetry.Telemetry that records the call
+    :return: The most likely score and the expected score, 1 to 5
+    """
+    messages = build_messages(original_text, summary_text, original_title, single_token=True)
+    if telemetry is not None:
+        telemetry.record_rows()
+    key = cache.key(MODEL, messages, TEMPERATURE, PROMPT_TEMPLATE_VERSION) if cache is not None else None
+    content = cache.get(key) if cache is not None else None
+    # Only a live call needs the client and credentials, a missing key raises even with fail_silent
+    client = get_client() if content is None else None
+    try:
+        if content is None:
+            with timed_call(telemetry) as call:
+                call.response = response = client.chat.completions.create(
+                    messages=messages,
+                    model=MODEL,
+                    temperature=TEMPERATURE,
+                    **SINGLE_TOKEN_PARAMS,
+                )
+            top_logprobs = response.choices[0].logprobs.content[0].top_logprobs
+            content = top_logprobs_content((top.token, top.logprob) for top in top_logprobs)
+        elif telemetry is not None:
+            telemetry.record_cache_hit()
+        scores = parse_logprob_score(content)
+        if scores[0] == -1:
+            if telemetry is not None:
+                telemetry.record_parse_failure()
+        elif client is not None and cache is not None:
+            cache.put(key, content)
+        return scores
+    except Exception as e:
+        if content is not None and telemetry is not None:
+            telemetry.record_parse_failure()
+        if not fail_silent:
+            raise e
+        print(f"Error: {e} for the following prompt: {messages}, response: {content}, returning -1")
+        return -1, -1.0
+
+
 # Example usage
 if __name__ == "__main__":
-    df = pd.read_csv(
-        "../data/mocked_fc_data.csv"
-    )  # mock dataset for demonstration purposes
-    for index, row in df.iterrows():
-        original_text = row["research_abstract"]
-        summary_text = row["reddit_post"]
-        fc_score = calculate_fc_using_gpt(original_text, summary_text)
-        df.at[index, "fc_score"] = fc_score
-    df.to_csv("./data/mocked_fc_data_with_scores.csv", index=False)
+    from fc_runner import merge_results, score_csv
+
+    # mock dataset for demonstration purposes, scores are checkpointed in the results file
+    score_csv("../data/mocked_fc_data.csv", "../data/mocked_fc_data_scores.jsonl", backend="gpt")
+    merge_results("../data/mocked_fc_data.csv", "../data/mocked_fc_data_scores.jsonl",
+                  "../data/mocked_fc_data_with_scores.csv")
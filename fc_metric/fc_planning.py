@@ -0,0 +1,87 @@
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def canonicalize(text) -> str:
+    """
+    Canonical form of a prompt field: NFKC normalized, whitespace collapsed and stripped, "" for missing values
+    """
+    if text is None or (isinstance(text, float) and np.isnan(text)):
+        return ""
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", str(text))).strip()
+
+
+class DedupPlan:
+    """
+    Maps the rows of a DataFrame to its unique canonical (abstract, title, summary) triples.
+    `unique` holds the first row of every triple with the canonical texts, `inverse[i]` is the
+    position in `unique` of row i.
+    """
+
+    def __init__(self, df: pd.DataFrame, abstract_column: str = "sem_scholar_abstract",
+                 summary_column: str = "title", title_column: str = "sem_scholar_title"):
+        columns = [column for column in (abstract_column, title_column, summary_column) if column in df.columns]
+        canonical = pd.DataFrame({column: df[column].map(canonicalize) for column in columns}, index=df.index)
+        codes = canonical.groupby(columns, sort=False).ngroup().to_numpy()
+        _, first = np.unique(codes, return_index=True)
+
+        self.index = df.index
+        self.inverse = codes
+        self.unique = df.iloc[first].copy()
+        self.unique[columns] = canonical.iloc[first].to_numpy()
+        self.unique.reset_index(drop=True, inplace=True)
+
+    @property
+    def n_rows(self) -> int:
+        return len(self.inverse)
+
+    @property
+    def n_unique(self) -> int:
+        return len(self.unique)
+
+    @property
+    def dedup_ratio(self) -> float:
+        """
+        Share of rows that did not need their own prompt
+        """
+        return 1 - self.n_unique / self.n_rows if self.n_rows else 0.0
+
+    def broadcast(self, unique_scores, name: str = "fc_score"):
+        """
+        Fan the scores of the unique triples back out to every originating row
+        :param unique_scores: One score per unique triple, or a DataFrame with one row per unique triple
+        """
+        if isinstance(unique_scores, pd.DataFrame):
+            return unique_scores.iloc[self.inverse].set_axis(self.index)
+        return pd.Series(np.asarray(unique_scores)[self.inverse], index=self.index, name=name)
+
+    def report(self) -> str:
+        return f"{self.n_rows} rows, {self.n_unique} unique prompts, dedup ratio {self.dedup_ratio:.1%}"
+
+
+def score_deduplicated(df: pd.DataFrame, score_unique, abstract_column: str = "sem_scholar_abstract",
+                       summary_column: str = "title", title_column: str = "sem_scholar_title"):
+    """
+    Score every unique triple of the DataFrame once and broadcast the scores back to all rows
+    :param score_unique: Function that scores a DataFrame of unique rows, returning one score per row
+    (or a DataFrame of scores)
+    :return: The fc scores aligned with the rows of the DataFrame
+    """
+    plan = DedupPlan(df, abstract_column, summary_column, title_column)
+    print(plan.report())
+    return plan.broadcast(score_unique(plan.unique))
+
+
+async def score_deduplicated_async(df: pd.DataFrame, score_unique, abstract_column: str = "sem_scholar_abstract",
+                                   summary_column: str = "title", title_column: str = "sem_scholar_title"):
+    """
+    score_deduplicated for a coroutine function score_unique
+    """
+    plan = DedupPlan(df, abstract_column, summary_column, title_column)
+    print(plan.report())
+    return plan.broadcast(await score_unique(plan.unique))
@@ -0,0 +1,83 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# The fc prompt, pre-rendered around its fields. Only depends on the standard library, so batch request files
+# can be written without the OpenAI client or credentials.
+SYSTEM_MESSAGE = "You are an expert evaluator of scientific reddit posts."
+_TASKINS = "reddit post summarization given the referenced research abstract"
+_ASPECT = "factual consistency or identical titles"
+_ANTASPECT = "inconsistencies or statements that can't be inferred"
+_ASPECTINS = "the degree to which the reddit summary can be inferred from the research abstract"
+
+_HEAD = (f"Score the following {_TASKINS} with respect to {_ASPECT} on a discrete scale from 1 to 5, \n"
+         f"where a score of 1 means “{_ANTASPECT}” and score of one 5 means “perfect {_ASPECT}”. \n"
+         f"Note that  {_ASPECT} measures {_ASPECTINS}. \n")
+_JSON_ANSWER = 'Respond in the following format: {"score": *insert score here*}'
+_SINGLE_TOKEN_ANSWER = "Respond with the score only, as a single digit."
+
+_PACKED_HEAD = (f"Score each of the following {_TASKINS.replace('summarization', 'summarizations')} with respect to "
+                f"{_ASPECT} on a discrete scale from 1 to 5, \n"
+                f"where a score of 1 means “{_ANTASPECT}” and score of one 5 means “perfect {_ASPECT}”. \n"
+                f"Note that  {_ASPECT} measures {_ASPECTINS.replace('the reddit', 'a reddit')}. "
+                f"Score every summary on its own. \n")
+
+
+def render_prompt(original_text, summary_text, original_title=None, single_token=False) -> str:
+    title_line = f"Research Title: {original_title}" if original_title else ""
+    answer = _SINGLE_TOKEN_ANSWER if single_token else _JSON_ANSWER
+    return f"{_HEAD}{title_line}\nResearch Abstract: {original_text}\nReddit Summary: {summary_text}  \n{answer}"
+
+
+def render_packed_prompt(original_text, summary_texts: list, original_title=None) -> str:
+    title_line = f"Research Title: {original_title}" if original_title else ""
+    summaries = "\n".join(f"{i}. {summary_text}" for i, summary_text in enumerate(summary_texts, 1))
+    return (f"{_PACKED_HEAD}{title_line}\nResearch Abstract: {original_text}\nReddit Summaries:\n{summaries}\n"
+            f"Respond with a JSON array of exactly {len(summary_texts)} integer scores, in the order of the "
+            f"summaries, and nothing else.")
+
+
+def render_messages(original_text, summary_text, original_title=None, single_token=False) -> list:
+    """
+    The chat messages of the factual consistency prompt
+    """
+    return [{"role": "system", "content": SYSTEM_MESSAGE},
+            {"role": "user", "content": render_prompt(original_text, summary_text, original_title, single_token)}]
+
+
+def render_packed_messages(original_text, summary_texts: list, original_title=None) -> list:
+    """
+    The chat messages of a factual consistency prompt with several numbered summaries
+    """
+    return [{"role": "system", "content": SYSTEM_MESSAGE},
+            {"role": "user", "content": render_packed_prompt(original_text, summary_texts, original_title)}]
+
+
+def dumps(obj) -> bytes:
+    """
+    Compact UTF-8 JSON, with orjson if it is installed
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def write_batch_requests(path: str, rows, model: str, params: dict = None, single_token: bool = False) -> int:
+    """
+    Write one Batch API request line per row
+    :param rows: (custom_id, original_text, summary_text, original_title) tuples
+    :param params: Extra request body parameters, e.g. {"temperature": 0}
+    :return: The number of written requests
+    """
+    params = params or {}
+    count = 0
+    with open(path, "wb", buffering=1 << 20) as f:
+        for custom_id, original_text, summary_text, original_title in rows:
+            messages = render_messages(original_text, summary_text, original_title, single_token)
+            f.write(dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions",
+                           "body": {"model": model, "messages": messages, **params}}) + b"\n")
+            count += 1
+    return count
@@ -0,0 +1,119 @@
+import argparse
+import json
+import os
+
+import pandas as pd
+
+from fc_backends import BACKENDS, get_backend, score_dataframe
+from llm_telemetry import Telemetry
+
+
+def read_results(results_path: str) -> dict:
+    """
+    Scores of an append-only results file by row id, later lines win.
+    A truncated last line (a crash during a write) is ignored.
+    """
+    scores = {}
+    if not os.path.exists(results_path):
+        return scores
+    with open(results_path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            scores[result["id"]] = result["fc_score"]
+    return scores
+
+
+def committed_ids(results_path: str, include_failed: bool = False) -> set:
+    """
+    Row ids that already have a score, rows that failed (-1) are scored again unless include_failed
+    """
+    return {row_id for row_id, score in read_results(results_path).items() if include_failed or score != -1}
+
+
+def score_csv(input_path: str, results_path: str, backend=None, id_column: str = None, chunksize: int = 1_000,
+              abstract_column: str = "research_abstract", summary_column: str = "reddit_post",
+              title_column: str = None, report: str = None) -> int:
+    """
+    Score a CSV chunk by chunk and append {"id", "fc_score"} lines to the results file after every chunk.
+    Rows whose id is already in the results file are skipped, so an interrupted run continues where it stopped.
+    :param backend: An fc backend instance or name, FC_BACKEND if not given
+    :param id_column: Column with unique row ids, the row number in the CSV if not given
+    :param report: If given, write the telemetry of this call to <report>.json and <report>.prom
+    :return: The number of rows scored by this call
+    """
+    if backend is None or isinstance(backend, str):
+        backend = get_backend(backend)
+    if report:
+        backend.telemetry = Telemetry(f"fc_{backend.name}", backend.model_name)
+    done = committed_ids(results_path)
+    print(f"{len(done)} rows already scored in {results_path}")
+
+    if os.path.exists(results_path) and os.path.getsize(results_path):
+        with open(results_path, "rb+") as f:
+            # Start on a new line after a line that was cut off by a crash
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+    n_scored = 0
+    offset = 0
+    with open(results_path, "a") as results:
+        for chunk in pd.read_csv(input_path, chunksize=chunksize):
+            ids = chunk[id_column].tolist() if id_column else list(range(offset, offset + len(chunk)))
+            offset += len(chunk)
+            todo = [row_id not in done for row_id in ids]
+            if not any(todo):
+                continue
+            chunk = chunk[todo]
+            scores = score_dataframe(chunk, backend, abstract_column, summary_column, title_column)
+            ids = [row_id for row_id, keep in zip(ids, todo) if keep]
+            for row_id, score in zip(ids, scores.tolist()):
+                results.write(json.dumps({"id": row_id, "fc_score": score}) + "\n")
+            results.flush()
+            os.fsync(results.fileno())
+            n_scored += len(chunk)
+            print(f"Scored {n_scored} rows")
+    if report:
+        backend.telemetry.write_report(report)
+    return n_scored
+
+
+def merge_results(input_path: str, results_path: str, output_path: str, id_column: str = None,
+                  score_column: str = "fc_score") -> pd.DataFrame:
+    """
+    Join the scores of the results file onto the input CSV and write it as CSV or Parquet (by the extension
+    of output_path). Rows without a score get -1.
+    """
+    df = pd.read_csv(input_path)
+    scores = read_results(results_path)
+    ids = df[id_column] if id_column else pd.Series(range(len(df)), index=df.index)
+    df[score_column] = ids.map(lambda row_id: scores.get(row_id, -1))
+    if output_path.endswith(".parquet"):
+        df.to_parquet(output_path, index=False)
+    else:
+        df.to_csv(output_path, index=False)
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checkpointed fc scoring of a CSV")
+    parser.add_argument("input", help="Input CSV")
+    parser.add_argument("results", help="Append-only JSONL results file, reused to resume")
+    parser.add_argument("--backend", choices=BACKENDS)
+    parser.add_argument("--id-column", help="Column with unique row ids (default: row number)")
+    parser.add_argument("--chunksize", type=int, default=1_000)
+    parser.add_argument("--abstract-column", default="research_abstract")
+    parser.add_argument("--summary-column", default="reddit_post")
+    parser.add_argument("--title-column")
+    parser.add_argument("--merge", metavar="OUTPUT", help="Only write the merged CSV/Parquet file")
+    parser.add_argument("--report", metavar="PATH", help="Write a telemetry report to PATH.json and PATH.prom")
+    args = parser.parse_args()
+
+    if args.merge:
+        merge_results(args.input, args.results, args.merge, args.id_column)
+    else:
+        score_csv(args.input, args.results, args.backend, args.id_column, args.chunksize,
+                  args.abstract_column, args.summary_column, args.title_column, args.report)
@@ -0,0 +1,188 @@
+import json
+import math
+import time
+from contextlib import contextmanager, nullcontext
+
+# USD per million (prompt, completion) tokens
+PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+}
+# The Batch API bills half the price
+BATCH_DISCOUNT = 0.5
+PERCENTILES = (50, 90, 99)
+
+
+def _usage(usage, key: str) -> int:
+    if usage is None:
+        return 0
+    value = usage.get(key) if isinstance(usage, dict) else getattr(usage, key, None)
+    return value or 0
+
+
+def percentile(values: list, q: float) -> float:
+    """
+    Nearest-rank percentile, None for no values
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, math.ceil(q / 100 * len(values)) - 1))]
+
+
+class _Call:
+    response = None
+
+
+def timed_call(telemetry=None):
+    """
+    telemetry.call(), or a context that records nothing if telemetry is None
+    """
+    return telemetry.call() if telemetry is not None else nullcontext(_Call())
+
+
+class Telemetry:
+    """
+    Collects the latency, token usage, retries, errors, parse failures and cache hits of the LLM calls of a
+    scoring job, and writes them as a run report in JSON and Prometheus text format.
+    """
+
+    def __init__(self, job: str, model: str = "gpt-4o-mini", prices: dict = None, discount: float = 1.0):
+        self.job = job
+        self.model = model
+        self.prices = PRICES if prices is None else prices
+        self.discount = discount
+        self.started = time.time()
+        self.latencies = []
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.parse_failures = 0
+        self.cache_hits = 0
+        self.rows = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def record_call(self, latency: float = None, usage=None, error: bool = False):
+        """
+        :param latency: Seconds, None for calls without a latency of their own (Batch API responses)
+        :param usage: The usage of the response, an object or a dict with prompt_tokens and completion_tokens
+        """
+        self.calls += 1
+        if latency is not None:
+            self.latencies.append(latency)
+        if error:
+            self.errors += 1
+        self.prompt_tokens += _usage(usage, "prompt_tokens")
+        self.completion_tokens += _usage(usage, "completion_tokens")
+
+    @contextmanager
+    def call(self):
+        """
+        Time an API call, usage is read from the response assigned to the yielded record:
+            with telemetry.call() as call:
+                call.response = client.chat.completions.create(...)
+        Failed calls are recorded as errors and re-raised.
+        """
+        record = _Call()
+        started = time.perf_counter()
+        try:
+            yield record
+        except Exception:
+            self.record_call(time.perf_counter() - started, error=True)
+            raise
+        self.record_call(time.perf_counter() - started, getattr(record.response, "usage", None))
+
+    def record_retry(self):
+        self.retries += 1
+
+    def record_parse_failure(self):
+        self.parse_failures += 1
+
+    def record_cache_hit(self):
+        self.cache_hits += 1
+
+    def record_rows(self, n: int = 1):
+        self.rows += n
+
+    def cost(self):
+        """
+        USD spent on the recorded tokens, None for a model without a price
+        """
+        if self.model not in self.prices:
+            return None
+        prompt_price, completion_price = self.prices[self.model]
+        return (self.prompt_tokens * prompt_price + self.completion_tokens * completion_price) / 1e6 * self.discount
+
+    def summary(self) -> dict:
+        cost = self.cost()
+        elapsed = time.time() - self.started
+        return {
+            "job": self.job,
+            "model": self.model,
+            "elapsed_seconds": elapsed,
+            "rows": self.rows,
+            "rows_per_second": self.rows / elapsed if elapsed else 0.0,
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "parse_failures": self.parse_failures,
+            "cache_hits": self.cache_hits,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "latency_seconds": {
+                **{f"p{q}": percentile(self.latencies, q) for q in PERCENTILES},
+                "mean": sum(self.latencies) / len(self.latencies) if self.latencies else None,
+                "max": max(self.latencies, default=None),
+            },
+            "cost_usd": cost,
+            "cost_per_1k_rows_usd": cost / self.rows * 1000 if cost is not None and self.rows else None,
+        }
+
+    def prometheus(self) -> str:
+        """
+        The summary in the Prometheus text exposition format
+        """
+        summary = self.summary()
+        labels = f'job="{self.job}",model="{self.model}"'
+        lines = []
+
+        def metric(name, kind, help_text, values):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for extra, value in values:
+                lines.append(f"{name}{{{labels}{extra}}} {'NaN' if value is None else value}")
+
+        metric("llm_rows_total", "counter", "Rows scored", [("", summary["rows"])])
+        metric("llm_calls_total", "counter", "API calls, including failed attempts", [("", summary["calls"])])
+        metric("llm_call_errors_total", "counter", "API calls that raised", [("", summary["errors"])])
+        metric("llm_retries_total", "counter", "Retried API calls", [("", summary["retries"])])
+        metric("llm_parse_failures_total", "counter", "Responses that could not be parsed",
+               [("", summary["parse_failures"])])
+        metric("llm_cache_hits_total", "counter", "Responses served from the cache", [("", summary["cache_hits"])])
+        metric("llm_tokens_total", "counter", "Tokens used",
+               [(',kind="prompt"', summary["prompt_tokens"]), (',kind="completion"', summary["completion_tokens"])])
+        metric("llm_call_latency_seconds", "summary", "Latency of the API calls",
+               [(f',quantile="{q / 100}"', summary["latency_seconds"][f"p{q}"]) for q in PERCENTILES])
+        lines.append(f"llm_call_latency_seconds_sum{{{labels}}} {sum(self.latencies)}")
+        lines.append(f"llm_call_latency_seconds_count{{{labels}}} {len(self.latencies)}")
+        if summary["cost_usd"] is not None:
+            metric("llm_cost_usd", "gauge", "Estimated cost of the job", [("", summary["cost_usd"])])
+        if summary["cost_per_1k_rows_usd"] is not None:
+            metric("llm_cost_per_1k_rows_usd", "gauge", "Estimated cost per 1000 rows",
+                   [("", summary["cost_per_1k_rows_usd"])])
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, path: str) -> dict:
+        """
+        Write <path>.json and <path>.prom
+        :return: The summary
+        """
+        summary = self.summary()
+        with open(f"{path}.json", "w") as f:
+            json.dump(summary, f, indent=2)
+        with open(f"{path}.prom", "w") as f:
+            f.write(self.prometheus())
+        print(f"{self.job}: {summary['rows']} rows, {summary['calls']} calls, p50 latency "
+              f"{summary['latency_seconds']['p50']}s, cost per 1k rows {summary['cost_per_1k_rows_usd']} USD")
+        return summary
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import sqlite3
+
+
+class ResponseCache:
+    """
+    Disk-backed cache of LLM response contents, keyed by a hash of
+    (model, messages, temperature, prompt template version).
+    When more than max_entries responses are cached, the least recently used ones are evicted.
+    """
+
+    def __init__(self, path: str = "fc_response_cache.sqlite", max_entries: int = 5_000_000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._connection = sqlite3.connect(path)
+        self._connection.executescript('''
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, content TEXT NOT NULL,
+                                                  last_used INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+        ''')
+        self._size, clock = self._connection.execute('SELECT COUNT(*), MAX(last_used) FROM responses').fetchone()
+        self._clock = clock or 0
+
+    @staticmethod
+    def key(model: str, messages: list, temperature: float, template_version: str) -> str:
+        payload = json.dumps({"model": model, "messages": messages, "temperature": temperature,
+                              "template_version": template_version}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """
+        The cached response content, None on a miss
+        """
+        row = self._connection.execute('SELECT content FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._clock += 1
+        self._connection.execute('UPDATE responses SET last_used = ? WHERE key = ?', (self._clock, key))
+        return row[0]
+
+    def put(self, key: str, content: str):
+        self.put_many([(key, content)])
+
+    def put_many(self, items):
+        """
+        Cache (key, content) pairs and evict the least recently used responses above max_entries
+        """
+        self._clock += 1
+        cursor = self._connection.executemany(
+            'INSERT OR IGNORE INTO responses (key, content, last_used) VALUES (?, ?, ?)',
+            ((key, content, self._clock) for key, content in items))
+        self._size += cursor.rowcount
+        if self._size > self.max_entries:
+            self._connection.execute(
+                'DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used LIMIT ?)',
+                (self._size - self.max_entries,))
+            self._size = self.max_entries
+        self._connection.commit()
+
+    def export_jsonl(self, path: str) -> int:
+        """
+        Write every cached response to a JSONL file, e.g. to move the cache to another machine
+        :return: The number of exported responses
+        """
+        count = 0
+        with open(path, "w") as f:
+            for key, content in self._connection.execute('SELECT key, content FROM responses ORDER BY last_used'):
+                f.write(json.dumps({"key": key, "content": content}) + "\n")
+                count += 1
+        return count
+
+    def import_jsonl(self, path: str) -> int:
+        """
+        Add the responses of an exported JSONL file to the cache
+        :return: The number of imported responses
+        """
+        with open(path) as f:
+            items = [(entry["key"], entry["content"]) for entry in map(json.loads, f)]
+        self.put_many(items)
+        return len(items)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": self._size}
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
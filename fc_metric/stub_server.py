@@ -0,0 +1,83 @@
+import json
+import random
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubChatCompletions(BaseHTTPRequestHandler):
+    """
+    Mimics POST /v1/chat/completions for offline runs of the fc scorers.
+    Every request is answered with '{"score": <score>}' (or the bare score with logprobs, if requested, or an
+    array of scores for packed prompts), a configurable share fails with 429 or 500.
+    """
+    score = 3
+    failure_rate = 0.0
+    # Share of packed prompts answered with an array that is one score short
+    packed_failure_rate = 0.0
+    failure_status = (429, 500)
+    requests_seen = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        type(self).requests_seen += 1
+        if random.random() < self.failure_rate:
+            self._send(random.choice(self.failure_status), {"error": {"message": "stub failure"}},
+                       {"retry-after": "0"})
+            return
+        prompt_tokens = sum(len(message["content"]) for message in body.get("messages", [])) // 4
+        content, logprobs = json.dumps({"score": self.score}), None
+        packed = re.search(r"JSON array of exactly (\d+)", body["messages"][-1]["content"]) if body.get("messages") \
+            else None
+        if packed:
+            n = int(packed.group(1)) - (random.random() < self.packed_failure_rate)
+            content = json.dumps([self.score] * n)
+        if body.get("logprobs"):
+            # Most of the mass on the score, the rest spread over the neighbours
+            content = str(self.score)
+            top_logprobs = [{"token": str(s), "logprob": -0.1 if s == self.score else -3.0, "bytes": None}
+                            for s in range(1, 6) if abs(s - self.score) <= 1]
+            logprobs = {"content": [{"token": content, "logprob": -0.1, "bytes": None,
+                                     "top_logprobs": top_logprobs[:body.get("top_logprobs") or 0]}]}
+        self._send(200, {
+            "id": f"chatcmpl-stub-{self.requests_seen}",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "logprobs": logprobs,
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 5, "total_tokens": prompt_tokens + 5},
+        })
+
+    def _send(self, status: int, payload: dict, headers: dict = None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_in_thread(handler=StubChatCompletions, port: int = 0):
+    """
+    Start the stub server on a background thread
+    :return: The server (call shutdown() when done) and the base_url to pass to the OpenAI client
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    server, base_url = serve_in_thread(port=8000)
+    print(f"Stub chat completions endpoint at {base_url}, press Ctrl+C to stop")
+    threading.Event().wait()
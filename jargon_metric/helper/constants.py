@@ -4,3 +4,9 @@ ROOT = os.getcwd()
 DATA = os.path.join(ROOT, 'data')
 CATEGORY = os.path.join(DATA, 'category')
 PMI_SCORES = os.path.join(DATA, 'pmi_scores')
+LEXICON = os.path.join(DATA, 'jargon_lexicon.jlex')
+REDDIT_CATEGORIES_PMI = os.path.join(DATA, 'reddit_categories_pmi')
+REDDIT_TO_CSV_CATEGORIES = os.path.join(DATA, 'reddit_to_csv_categories.json')
+SCIENCE_CSVS = os.path.join(DATA, 'science_csvs')
+JARGON_SCORES = os.path.join(DATA, 'science_jargon_parquet')
+TOKEN_CACHE = os.path.join(DATA, 'token_cache.sqlite')
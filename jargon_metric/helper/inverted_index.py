@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import constants
+from lexicon_store import Lexicon, open_lexicon
+
+
+class InvertedIndex:
+    """
+    Word → (category, PMI) postings over every category lexicon, sorted by descending PMI per word
+    """
+
+    def __init__(self, lexicon: Lexicon):
+        self.lexicon = lexicon
+        self.categories = lexicon.categories
+        matrix = lexicon.matrix().tocoo()
+        order = np.lexsort((-matrix.data, matrix.row))
+        self.category_ids = matrix.col[order].astype(np.int32)
+        self.pmi = matrix.data[order]
+        self.indptr = np.zeros(lexicon.n_words + 1, dtype=np.int64)
+        np.cumsum(np.bincount(matrix.row, minlength=lexicon.n_words), out=self.indptr[1:])
+
+    def _postings(self, word_id: int, k: int = None):
+        start, end = self.indptr[word_id], self.indptr[word_id + 1]
+        if k is not None:
+            end = min(end, start + k)
+        return [(self.categories[c], float(p)) for c, p in zip(self.category_ids[start:end], self.pmi[start:end])]
+
+    def postings(self, word: str) -> [(str, float)]:
+        """
+        All (category, PMI) postings of the word (exact match), highest PMI first
+        """
+        word_id = self.lexicon.word_index().get(word)
+        return [] if word_id is None else self._postings(word_id)
+
+    def top_k(self, word: str, k: int = 5) -> [(str, float)]:
+        """
+        The k categories in which the word has the highest PMI
+        """
+        word_id = self.lexicon.word_index().get(word)
+        return [] if word_id is None else self._postings(word_id, k)
+
+    def lookup_batch(self, words: [str], k: int = None) -> dict:
+        """
+        Postings (the top k if given) of every word in the list
+        """
+        index = self.lexicon.word_index()
+        return {word: self._postings(index[word], k) if word in index else [] for word in words}
+
+    def ambiguity(self, threshold: float = 0.1) -> pd.DataFrame:
+        """
+        Ambiguity statistics of every word in the vocabulary:
+        the number of categories where the word is jargon (PMI > threshold), the best and second best
+        category with their PMI, and the entropy of the word's positive PMI over those categories.
+        """
+        n_words = self.lexicon.n_words
+        lengths = np.diff(self.indptr)
+        rows = np.repeat(np.arange(n_words), lengths)
+        jargon = self.pmi > np.float32(threshold)
+        n_categories = np.bincount(rows, weights=jargon, minlength=n_words).astype(np.int32)
+
+        has_first = lengths >= 1
+        has_second = lengths >= 2
+        first = self.indptr[:-1]
+        best_pmi = np.full(n_words, np.nan, dtype=np.float32)
+        best_pmi[has_first] = self.pmi[first[has_first]]
+        second_pmi = np.full(n_words, np.nan, dtype=np.float32)
+        second_pmi[has_second] = self.pmi[first[has_second] + 1]
+        categories = np.asarray(self.categories + [None], dtype=object)
+        last = max(len(self.pmi) - 1, 0)
+        best_category = categories[np.where(has_first, self.category_ids[np.minimum(first, last)], -1)]
+        second_category = categories[np.where(has_second, self.category_ids[np.minimum(first + 1, last)], -1)]
+
+        weights = np.where(jargon, self.pmi, 0).astype(np.float64)
+        totals = np.bincount(rows, weights=weights, minlength=n_words)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            shares = weights / totals[rows]
+            information = np.where(shares > 0, shares * np.log2(shares), 0)
+        entropy = 0.0 - np.bincount(rows, weights=information, minlength=n_words)
+
+        return pd.DataFrame({
+            'word': self.lexicon.words,
+            'n_categories': n_categories,
+            'best_category': best_category,
+            'best_pmi': best_pmi,
+            'second_category': second_category,
+            'second_pmi': second_pmi,
+            'entropy': entropy,
+        }).sort_values(['n_categories', 'entropy'], ascending=False, ignore_index=True)
+
+
+if __name__ == "__main__":
+    index = InvertedIndex(open_lexicon(constants.LEXICON))
+    print(index.lookup_batch(["kernel", "tree", "model"], k=5))
+    print(index.ambiguity().head(50))
+    print("Done!")
@@ -1,19 +1,18 @@
-import os
-import pandas as pd
+import numpy as np
 import constants
-from nlp_loader import nlp
+from lexicon_store import open_lexicon
+from nlp_loader import filter_texts
 
 
-def filter_text(text: str):
+def filter_text(text: str, backend: str = None):
     """
     Tokenize the text, lowercase, and remove punctuation, stopwords
     """
-    doc = nlp(text)
-    words = [token.text.lower() for token in doc if not token.is_punct and not token.is_stop]
-    return words
+    return next(filter_texts([text], backend=backend))
 
 
-def calculate_jargon_metric(text: str, related_categories: [str] = None, threshold: float = 0.1):
+def calculate_jargon_metric(text: str, related_categories: [str] = None, threshold: float = 0.1,
+                            backend: str = None, weighted: bool = False):
     """
     Calculate the proportion of jargon words in a given text.
 
@@ -21,39 +20,65 @@ def calculate_jargon_metric(text: str, related_categories: [str] = None, thresho
     2. Count the number of “jargon”-words for each category
         a. For each category, store the number of jargon words that appear in the text
     3. count proportions of words that are in the list of jargon
+
+    Without related_categories the text is scored against every category. With weighted=True each
+    jargon word counts with its PMI in the category instead of 1.
+    """
+    lexicon = open_lexicon(constants.LEXICON)
+    return _jargon_proportions(lexicon, filter_text(text, backend), related_categories, threshold, weighted)
+
+
+def calculate_jargon_metric_batch(texts, categories, threshold: float = 0.1, batch_size: int = 1000,
+                                  n_process: int = 1, backend: str = None, weighted: bool = False, cache=None):
+    """
+    Calculate the proportion of jargon words for many texts in a single pass through nlp.pipe.
+    :param texts: Iterable of texts
+    :param categories: Iterable aligned with texts, holding the related categories of each text
+        (None scores the text against every category)
+    :param threshold: Words with a PMI above the threshold count as jargon, any value works
+    :param batch_size: Number of texts per nlp.pipe batch
+    :param n_process: Number of processes used by nlp.pipe
+    :param backend: The tokenizer backend (spacy, blank or regex), see nlp_loader
+    :param weighted: Weight every jargon word with its PMI in the category
+    :param cache: Optional token_cache.TokenCache, only uncached texts are tokenized
+    :return: A list with one jargon proportion dict per text, in input order
     """
-    category_path = constants.PMI_SCORES
-    words = filter_text(text)
+    lexicon = open_lexicon(constants.LEXICON)
+    tokenize = filter_texts if cache is None else cache.filter_texts
+    words_per_text = tokenize(texts, backend=backend, batch_size=batch_size, n_process=n_process)
+    return [_jargon_proportions(lexicon, words, related_categories, threshold, weighted)
+            for words, related_categories in zip(words_per_text, categories)]
+
+
+def _jargon_proportions(lexicon, words: [str], related_categories: [str] = None, threshold: float = 0.1,
+                        weighted: bool = False):
     total_words = len(words)
     if total_words == 0:
         return {"NONE": 0}
-    jargon_proportions = {}
 
-    all_categories = os.listdir(os.path.join(category_path, str(threshold)))
+    # Score against every category at once with one row-gather of the word×category PMI matrix
+    scores = lexicon.jargon_scores(lexicon.lookup(set(words)), threshold, weighted) / total_words
 
-    # Get all the categories that are in the reddit_category list and in the PMI_SCORES folder
+    # Get all the categories that are in the reddit_category list and in the compiled lexicon
+    categories = lexicon.categories
     if related_categories:
-        categories = list(set(all_categories).intersection(set(related_categories)))
-
-    for category in categories:
-        # File path is category path / threshold / category
-        file_path = os.path.join(os.path.join(category_path, str(threshold)), category)
-        data = pd.read_csv(file_path)
-
-        jargon_words = len(set(words).intersection(set(data['word'].values)))
-        # TODO: Should there be any weighting of the jargon words or just use threshold?
-        jargon_proportions[category] = jargon_words / total_words
+        categories = [category for category in set(related_categories) if category in lexicon]
 
-    return jargon_proportions
+    return {category: float(scores[lexicon.category_id(category)]) for category in categories}
 
 
 def get_top_n_jargon_categories(jargon_proportions, n=5):
     """
     Get the top n categories with the highest proportion of jargon words in the text.
     """
-    sorted_jargon_proportions = sorted(jargon_proportions.items(), key=lambda x: x[1], reverse=True)
-    top_n = sorted_jargon_proportions[:n]
-    return top_n
+    categories = list(jargon_proportions)
+    proportions = np.fromiter(jargon_proportions.values(), dtype=np.float64, count=len(categories))
+    n = max(min(n, len(categories)), 0)
+    if n == 0:
+        return []
+    top = np.argpartition(-proportions, n - 1)[:n]
+    top = top[np.argsort(-proportions[top], kind='stable')]
+    return [(categories[i], jargon_proportions[categories[i]]) for i in top]
 
 
 if __name__ == "__main__":
@@ -0,0 +1,214 @@
+import mmap
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import constants
+
+# Binary layout (little endian, numeric sections aligned to 8 bytes):
+#   header | words ('\n'-joined utf-8, sorted) | categories ('\n'-joined utf-8)
+#   | indptr uint64[n_categories + 1] | word_ids int32[n_entries] | pmi float32[n_entries]
+#   | ranked_ids int32[n_entries] | ranked_pmi float32[n_entries]
+# Word ids are the rank of the word in the sorted word table. The entries of every category are
+# stored twice: sorted by word id, so membership is a binary search, and sorted by ascending PMI,
+# so the lexicon at any threshold is the suffix after a binary search cut.
+MAGIC = b'JLEX'
+VERSION = 2
+HEADER = struct.Struct('<4sIIIQQQ')
+
+_open_lexicons = {}
+
+
+def _pad(size: int) -> int:
+    return (8 - size % 8) % 8
+
+
+def compile_lexicon(input_folder: str, output_path: str):
+    """
+    Compile a folder of category CSVs (word, pmi) into a single binary lexicon file.
+    Every row is kept, so the lexicon serves any PMI threshold.
+    """
+    unprocessed_files = []
+    category_frames = {}
+    for filename in sorted(os.listdir(input_folder)):
+        data = pd.read_csv(os.path.join(input_folder, filename), dtype={'word': str})
+        if 'word' not in data.columns or 'pmi' not in data.columns:
+            print(f"KeyError: 'word' or 'pmi' column not found in {filename}")
+            unprocessed_files.append(filename)
+            continue
+        data = data.dropna(subset=['word', 'pmi'])
+        # Newlines separate the entries of the word table
+        data = data[~data['word'].str.contains('\n', regex=False)]
+        category_frames[filename] = data
+
+    vocabulary = pd.Index(sorted(set().union(*(set(df['word']) for df in category_frames.values()))))
+
+    indptr = [0]
+    word_ids = []
+    pmi = []
+    ranked_ids = []
+    ranked_pmi = []
+    for data in category_frames.values():
+        ids = vocabulary.get_indexer(data['word']).astype(np.int32)
+        # Sort by word id and keep a single entry per word
+        ids, first = np.unique(ids, return_index=True)
+        scores = data['pmi'].to_numpy(dtype=np.float32)[first]
+        word_ids.append(ids)
+        pmi.append(scores)
+        order = np.argsort(scores, kind='stable')
+        ranked_ids.append(ids[order])
+        ranked_pmi.append(scores[order])
+        indptr.append(indptr[-1] + len(ids))
+
+    words_blob = '\n'.join(vocabulary).encode('utf-8')
+    categories_blob = '\n'.join(category_frames).encode('utf-8')
+    n_entries = indptr[-1]
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(vocabulary), len(category_frames), n_entries,
+                            len(words_blob), len(categories_blob)))
+        for blob in (words_blob, categories_blob):
+            f.write(blob)
+            f.write(b'\0' * _pad(len(blob)))
+        f.write(np.asarray(indptr, dtype=np.uint64).tobytes())
+        for array in (word_ids, pmi, ranked_ids, ranked_pmi):
+            section = np.concatenate(array).tobytes() if array else b''
+            f.write(section)
+            f.write(b'\0' * _pad(len(section)))
+
+    print(f"Compiled {len(category_frames)} categories and {len(vocabulary)} words into {output_path}")
+    if len(unprocessed_files) > 0:
+        print(f"Files that were not processed: {unprocessed_files}")
+
+
+class Lexicon:
+    """
+    Read-only view of a compiled lexicon. All arrays are views into the underlying buffer.
+    A prebuilt word×category matrix can be passed in, e.g. one that lives in shared memory.
+    """
+
+    def __init__(self, buffer, matrix: sp.csr_matrix = None):
+        self._buffer = buffer
+        magic, version, n_words, n_categories, n_entries, words_nbytes, categories_nbytes = \
+            HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a version {VERSION} jargon lexicon")
+
+        offset = HEADER.size
+        self._words_slice = (offset, offset + words_nbytes)
+        offset += words_nbytes + _pad(words_nbytes)
+        categories = bytes(buffer[offset:offset + categories_nbytes]).decode('utf-8')
+        self.categories = categories.split('\n') if n_categories else []
+        offset += categories_nbytes + _pad(categories_nbytes)
+
+        self.indptr = np.frombuffer(buffer, dtype=np.uint64, count=n_categories + 1, offset=offset)
+        offset += self.indptr.nbytes
+        self.word_ids = np.frombuffer(buffer, dtype=np.int32, count=n_entries, offset=offset)
+        offset += self.word_ids.nbytes + _pad(self.word_ids.nbytes)
+        self.pmi = np.frombuffer(buffer, dtype=np.float32, count=n_entries, offset=offset)
+        offset += self.pmi.nbytes + _pad(self.pmi.nbytes)
+        self.ranked_ids = np.frombuffer(buffer, dtype=np.int32, count=n_entries, offset=offset)
+        offset += self.ranked_ids.nbytes + _pad(self.ranked_ids.nbytes)
+        self.ranked_pmi = np.frombuffer(buffer, dtype=np.float32, count=n_entries, offset=offset)
+
+        self.n_words = n_words
+        self._category_index = {category: i for i, category in enumerate(self.categories)}
+        self._words = None
+        self._word_index = None
+        self._matrix = matrix
+
+    def __contains__(self, category):
+        return category in self._category_index
+
+    @property
+    def words(self) -> [str]:
+        if self._words is None:
+            start, end = self._words_slice
+            self._words = bytes(self._buffer[start:end]).decode('utf-8').split('\n') if self.n_words else []
+        return self._words
+
+    def word_index(self) -> dict:
+        """
+        Mapping from word to word id, built on first use
+        """
+        if self._word_index is None:
+            self._word_index = {word: i for i, word in enumerate(self.words)}
+        return self._word_index
+
+    def lookup(self, words) -> np.ndarray:
+        """
+        Word ids of the known words, in order of appearance
+        """
+        index = self.word_index()
+        return np.fromiter((index[word] for word in words if word in index), dtype=np.int32)
+
+    def category_id(self, category: str) -> int:
+        return self._category_index[category]
+
+    def _bounds(self, category: str):
+        i = self._category_index[category]
+        return int(self.indptr[i]), int(self.indptr[i + 1])
+
+    def matrix(self) -> sp.csr_matrix:
+        """
+        Sparse float32 word×category PMI matrix, built on first use.
+        The word-sorted entries of the categories already are its CSC representation.
+        """
+        if self._matrix is None:
+            shape = (self.n_words, len(self.categories))
+            self._matrix = sp.csc_matrix((self.pmi, self.word_ids, self.indptr.astype(np.int64)), shape=shape).tocsr()
+        return self._matrix
+
+    def jargon_scores(self, word_ids: np.ndarray, threshold: float = None, weighted: bool = False) -> np.ndarray:
+        """
+        Per category, the number (or with weighted=True the summed PMI) of the given unique word ids
+        that are in the lexicon of the category with PMI > threshold
+        """
+        rows = self.matrix()[word_ids]
+        values = rows.data
+        if threshold is not None:
+            values = np.where(values > np.float32(threshold), values if weighted else 1, 0)
+        elif not weighted:
+            values = np.ones_like(values)
+        return np.bincount(rows.indices, weights=values, minlength=len(self.categories))
+
+    def ranked_slice(self, category: str, threshold: float = None):
+        """
+        Word ids and PMI of the category in ascending PMI order, cut to the entries with PMI > threshold
+        """
+        start, end = self._bounds(category)
+        ids, pmi = self.ranked_ids[start:end], self.ranked_pmi[start:end]
+        if threshold is not None:
+            cut = int(np.searchsorted(pmi, np.float32(threshold), side='right'))
+            ids, pmi = ids[cut:], pmi[cut:]
+        return ids, pmi
+
+    def jargon_words(self, category: str, threshold: float = None) -> [str]:
+        """
+        The words of the category with PMI > threshold
+        """
+        ids, _ = self.ranked_slice(category, threshold)
+        words = self.words
+        return [words[i] for i in ids]
+
+
+def open_lexicon(path: str) -> Lexicon:
+    """
+    Memory-map a compiled lexicon. The lexicon is opened once per process and shared by every call.
+    """
+    lexicon = _open_lexicons.get(path)
+    if lexicon is None:
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        lexicon = Lexicon(buffer)
+        _open_lexicons[path] = lexicon
+    return lexicon
+
+
+if __name__ == "__main__":
+    compile_lexicon(constants.CATEGORY, constants.LEXICON)
+
+    print("Done!")
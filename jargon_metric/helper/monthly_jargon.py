@@ -0,0 +1,150 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import scipy.sparse as sp
+import constants
+
+OUTPUT_SCHEMA = pa.schema([
+    ('id', pa.string()),
+    ('title', pa.string()),
+    ('link_flair_text', pa.string()),
+    ('category', pa.string()),
+    ('num_words', pa.int32()),
+    ('num_jargon_words', pa.int32()),
+    ('jargon_proportion', pa.float32()),
+])
+
+# Flairs that were renamed over the years, mapped to the name of their lexicon
+FLAIR_ALIASES = {
+    'Computer Sci': 'Computer Science',
+}
+
+
+class FlairLexicons:
+    """
+    Jargon words of every flair, as a word×flair indicator matrix over an integer word vocabulary
+    """
+
+    def __init__(self, folder: str):
+        flair_words = {}
+        for flair in sorted(os.listdir(folder)):
+            if flair.startswith('.'):
+                continue
+            words = pd.read_csv(os.path.join(folder, flair), dtype=str).iloc[:, 0].dropna()
+            flair_words[flair] = words.unique()
+
+        self.flairs = pd.Index(list(flair_words))
+        self.vocabulary = pd.Index(np.unique(np.concatenate(list(flair_words.values()))) if flair_words else [])
+
+        rows = [self.vocabulary.get_indexer(words) for words in flair_words.values()]
+        cols = [np.full(len(words), i, dtype=np.int32) for i, words in enumerate(flair_words.values())]
+        rows = np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+        cols = np.concatenate(cols) if cols else np.empty(0, dtype=np.int32)
+        self.indicator = sp.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)),
+                                       shape=(len(self.vocabulary), len(self.flairs)))
+
+
+def normalize_flairs(flairs: pd.Series) -> pd.Series:
+    """
+    Map link flairs to lexicon categories, dropping AMA and discussion flairs
+    """
+    flairs = flairs.astype(object)
+    irrelevant = (flairs.str.endswith('AMA', na=True) | flairs.str.endswith('Discussion', na=True)
+                  | (flairs == ''))
+    return flairs.mask(irrelevant).replace(FLAIR_ALIASES)
+
+
+def score_chunk(df: pd.DataFrame, lexicons: FlairLexicons) -> pd.DataFrame:
+    """
+    Proportion of jargon words of the post flair in every title of the chunk.
+    Titles are split on whitespace, as in v2_jargon_metric.ipynb, and every post is scored with one
+    sparse product of its post×word matrix against the word×flair indicator matrix.
+    """
+    titles = df['title'].fillna('').astype(str).str.split()
+    num_words = titles.str.len().to_numpy(dtype=np.int32)
+
+    tokens = titles.explode()
+    word_ids = lexicons.vocabulary.get_indexer(tokens.dropna())
+    posts = np.repeat(np.arange(len(df)), num_words)
+    known = word_ids >= 0
+    words_in_posts = sp.csr_matrix((np.ones(known.sum(), dtype=np.float32), (posts[known], word_ids[known])),
+                                   shape=(len(df), len(lexicons.vocabulary)))
+    # Count every distinct word of a title once
+    words_in_posts.sum_duplicates()
+    words_in_posts.data[:] = 1
+    jargon_counts = (words_in_posts @ lexicons.indicator).tocsr()
+
+    categories = normalize_flairs(df['link_flair_text'])
+    codes = lexicons.flairs.get_indexer(categories)
+    scored = codes >= 0
+    num_jargon_words = np.zeros(len(df), dtype=np.int32)
+    num_jargon_words[scored] = np.asarray(jargon_counts[np.flatnonzero(scored), codes[scored]]).ravel()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        proportions = np.where(num_words > 0, num_jargon_words / num_words, 0).astype(np.float32)
+    proportions[~scored] = np.nan
+
+    return pd.DataFrame({
+        'id': df['id'].astype(str).to_numpy(),
+        'title': df['title'].to_numpy(),
+        'link_flair_text': df['link_flair_text'].to_numpy(),
+        'category': categories.where(scored).to_numpy(),
+        'num_words': num_words,
+        'num_jargon_words': num_jargon_words,
+        'jargon_proportion': proportions,
+    })
+
+
+def score_months(input_folder: str, output_folder: str, lexicon_folder: str, chunksize: int = 100_000):
+    """
+    Score every monthly CSV in the input folder chunk by chunk and write one Parquet file per month.
+    A post is only scored the first time it is read with a flair that has a lexicon, later rows of it are skipped.
+    """
+    lexicons = FlairLexicons(lexicon_folder)
+    os.makedirs(output_folder, exist_ok=True)
+
+    posts_read = set()
+    invalid_files = []
+    for filename in sorted(os.listdir(input_folder)):
+        if not filename.endswith('.csv'):
+            continue
+        output_path = os.path.join(output_folder, filename[:-len('.csv')] + '.parquet')
+        try:
+            chunks = pd.read_csv(os.path.join(input_folder, filename), chunksize=chunksize,
+                                 usecols=['id', 'title', 'link_flair_text'], dtype=str)
+            with pq.ParquetWriter(output_path, OUTPUT_SCHEMA) as writer:
+                for chunk in chunks:
+                    chunk = chunk[[post_id not in posts_read for post_id in chunk['id']]]
+                    scores = score_chunk(chunk.reset_index(drop=True), lexicons)
+                    # As in the notebook, a post is only read once its flair is scored, so a repost of an AMA,
+                    # Discussion or flairless post under a real flair is still scored. Later scored rows are skipped.
+                    scored = scores['category'].notna().to_numpy()
+                    repeated = np.zeros(len(scores), dtype=bool)
+                    repeated[scored] = scores['id'][scored].duplicated().to_numpy()
+                    scores = scores[~repeated]
+                    posts_read.update(scores['id'][scored[~repeated]])
+                    writer.write_table(pa.Table.from_pandas(scores, schema=OUTPUT_SCHEMA, preserve_index=False))
+        except (ValueError, pd.errors.ParserError) as e:
+            print(f"Invalid file: {filename} ({e})")
+            invalid_files.append(filename)
+            continue
+        print(f"Scores saved to {output_path}")
+
+    if len(invalid_files) > 0:
+        print(f"Files that were not processed: {invalid_files}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score the jargon proportion of every r/science title per month")
+    parser.add_argument('--input', default=constants.SCIENCE_CSVS, help="Folder with the monthly CSV dumps")
+    parser.add_argument('--output', default=constants.JARGON_SCORES, help="Folder for the Parquet output")
+    parser.add_argument('--lexicons', default=constants.REDDIT_CATEGORIES_PMI, help="Folder with the flair lexicons")
+    parser.add_argument('--chunksize', type=int, default=100_000, help="Number of rows read at a time")
+    args = parser.parse_args()
+    score_months(args.input, args.output, args.lexicons, args.chunksize)
+
+    print("Done!")
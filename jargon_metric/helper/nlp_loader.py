@@ -1,3 +1,85 @@
-import spacy
+import os
+import re
 
-nlp = spacy.load("en_core_web_lg")
\ No newline at end of file
+# Tokenizer backends:
+#   spacy: the full en_core_web_lg pipeline (only its tokenizer is used for filtering)
+#   blank: a vectorless blank English spaCy tokenizer with the same stop-word list
+#   regex: a pure-regex tokenizer, the fastest option for bulk runs
+BACKENDS = ('spacy', 'blank', 'regex')
+DEFAULT_BACKEND = os.getenv('JARGON_TOKENIZER', 'spacy')
+SPACY_MODEL = 'en_core_web_lg'
+
+# Splits off n't and the 's of possessives and contractions, an opening quote stays punctuation. Keeps 3.5 and u.s.
+# whole, and like the infix rules of the spaCy tokenizer keeps =:<>/, commas and a hyphen after a letter inside the
+# word when a digit follows (covid-19, 10,000, n=20, p<0.05), but splits them before a letter (e-cigarettes) and
+# splits a hyphen between digits (2019-2020)
+TOKEN_PATTERN = re.compile(r"n['’]t|(?<=\w)['’]\w+|\w+(?:\.\w+)+\.?|\w+(?=n['’]t)"
+                           r"|\w+(?:(?:(?<=[^\W\d])-|[,:<>=/]\.?|\.)\d\w*)*|[^\w\s]")
+WORD_PATTERN = re.compile(r"\w")
+
+_pipelines = {}
+_stop_words = None
+
+
+def get_nlp(backend: str = None):
+    """
+    Load the spaCy pipeline of the backend on first use
+    """
+    backend = backend or DEFAULT_BACKEND
+    if backend not in _pipelines:
+        import spacy
+
+        if backend == 'spacy':
+            _pipelines[backend] = spacy.load(SPACY_MODEL)
+        elif backend == 'blank':
+            _pipelines[backend] = spacy.blank('en')
+        else:
+            raise ValueError(f"No spaCy pipeline for tokenizer backend {backend}, choose one of {BACKENDS[:2]}")
+    return _pipelines[backend]
+
+
+def get_stop_words() -> frozenset:
+    """
+    The English spaCy stop-word list, shared by every backend
+    """
+    global _stop_words
+    if _stop_words is None:
+        from spacy.lang.en.stop_words import STOP_WORDS
+
+        _stop_words = frozenset(STOP_WORDS)
+    return _stop_words
+
+
+def regex_filter(text: str) -> [str]:
+    """
+    Tokenize with a regular expression, lowercase, and remove punctuation, stopwords
+    """
+    stop_words = get_stop_words()
+    words = []
+    for token in TOKEN_PATTERN.findall(text):
+        word = token.lower()
+        if WORD_PATTERN.search(word) and word not in stop_words:
+            words.append(word)
+    return words
+
+
+def filter_texts(texts, backend: str = None, batch_size: int = 1000, n_process: int = 1):
+    """
+    Tokenize a stream of texts, lowercase, and remove punctuation, stopwords.
+    is_punct and is_stop are lexical attributes, so every spaCy pipeline component is disabled.
+    Yields the words of each text in input order.
+    """
+    backend = backend or DEFAULT_BACKEND
+    if backend == 'regex':
+        yield from map(regex_filter, texts)
+        return
+    nlp = get_nlp(backend)
+    for doc in nlp.pipe(texts, batch_size=batch_size, n_process=n_process, disable=nlp.pipe_names):
+        yield [token.text.lower() for token in doc if not token.is_punct and not token.is_stop]
+
+
+def __getattr__(name):
+    # Keeps `from nlp_loader import nlp` working without loading the model at import time
+    if name == 'nlp':
+        return get_nlp('spacy')
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
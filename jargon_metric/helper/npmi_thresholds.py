@@ -1,32 +1,29 @@
 import pandas as pd
 import os
 import constants
+from lexicon_store import compile_lexicon, open_lexicon
 
-def create_new_dataset(input_folder, output_folder, threshold):
-    # Keep track of the files that have not been processed
-    unprocessed_files = []
-    for filename in os.listdir(input_folder):
-        file_path = os.path.join(input_folder, filename)
-        data = pd.read_csv(file_path)
 
-        try:
-            filtered_data = data[data['pmi'] > threshold]
-        except KeyError:
-            print(f"KeyError: 'pmi' column not found in {file_path}")
-            unprocessed_files.append(filename)
-            continue
-        output_path = os.path.join(os.path.join(output_folder, str(threshold)), filename)
+def create_new_dataset(lexicon_file, output_folder, threshold):
+    """
+    Write the category lexicons at a threshold as CSVs (word, pmi) to output_folder/threshold.
+    Only needed for tools that read the CSVs, calculate_jargon_metric accepts any threshold directly.
+    """
+    lexicon = open_lexicon(lexicon_file)
+    os.makedirs(os.path.join(output_folder, str(threshold)), exist_ok=True)
+    words = lexicon.words
+    for category in lexicon.categories:
+        ids, pmi = lexicon.ranked_slice(category, threshold)
+        filtered_data = pd.DataFrame({'word': [words[i] for i in ids[::-1]], 'pmi': pmi[::-1]})
+        output_path = os.path.join(os.path.join(output_folder, str(threshold)), category)
         filtered_data.to_csv(output_path, index=False)
 
         print(f"Filtered data saved to {output_path}")
-    if (len(unprocessed_files) > 0):
-        print(f"Files that were not processed: {unprocessed_files}")
 
 
 if __name__ == "__main__":
+    # A single ingest pass replaces the per-threshold rebuilds
     input_folder = constants.CATEGORY
-    output_folder = constants.PMI_SCORES
-    threshold = 0.1
-    create_new_dataset(input_folder, output_folder, threshold)
+    compile_lexicon(input_folder, constants.LEXICON)
 
     print("Done!")
@@ -0,0 +1,141 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import constants
+from jargon_proportions import _jargon_proportions
+from lexicon_store import Lexicon, _pad, open_lexicon
+from nlp_loader import DEFAULT_BACKEND, filter_texts, get_nlp
+
+# State of a pool worker, set once by _init_worker
+_worker = {}
+
+
+class SharedLexicon:
+    """
+    A compiled lexicon and its word×category matrix copied into one shared memory block,
+    so pool workers attach to the same arrays instead of each loading the lexicon.
+    Use as a context manager, the block is unlinked on exit.
+    """
+
+    def __init__(self, path: str = constants.LEXICON):
+        with open(path, 'rb') as f:
+            lexicon_bytes = f.read()
+        lexicon = open_lexicon(path)
+        matrix = lexicon.matrix()
+        self.categories = lexicon.categories
+
+        sections = []
+        offset = len(lexicon_bytes) + _pad(len(lexicon_bytes))
+        for array in (matrix.indptr, matrix.indices, matrix.data):
+            sections.append((offset, array.dtype.str, len(array)))
+            offset += array.nbytes + _pad(array.nbytes)
+
+        self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        self.shm.buf[:len(lexicon_bytes)] = lexicon_bytes
+        for (start, _, _), array in zip(sections, (matrix.indptr, matrix.indices, matrix.data)):
+            self.shm.buf[start:start + array.nbytes] = array.tobytes()
+        self.layout = (len(lexicon_bytes), matrix.shape, sections)
+
+    @staticmethod
+    def attach(name: str, layout) -> (shared_memory.SharedMemory, Lexicon):
+        """
+        Attach to the block from another process, the lexicon arrays are zero-copy views into it
+        """
+        shm = shared_memory.SharedMemory(name=name)
+        lexicon_size, shape, sections = layout
+        indptr, indices, data = (np.frombuffer(shm.buf, dtype=dtype, count=count, offset=offset)
+                                 for offset, dtype, count in sections)
+        matrix = sp.csr_matrix((data, indices, indptr), shape=shape, copy=False)
+        return shm, Lexicon(shm.buf[:lexicon_size], matrix=matrix)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _init_worker(shm_name, layout, backend):
+    shm, lexicon = SharedLexicon.attach(shm_name, layout)
+    # Keep the block mapped for the lifetime of the worker
+    _worker['shm'] = shm
+    _worker['lexicon'] = lexicon
+    _worker['backend'] = backend
+    if backend != 'regex':
+        get_nlp(backend)
+
+
+def _score_chunk(chunk):
+    texts, categories, threshold, weighted = chunk
+    lexicon = _worker['lexicon']
+    words_per_text = filter_texts(texts, backend=_worker['backend'], n_process=1)
+    return [_jargon_proportions(lexicon, words, related_categories, threshold, weighted)
+            for words, related_categories in zip(words_per_text, categories)]
+
+
+def _score_file(task):
+    path, text_column, threshold, weighted = task
+    texts = pd.read_csv(path, usecols=[text_column])[text_column].fillna('').astype(str)
+    lexicon = _worker['lexicon']
+    # One float32 row per text goes back to the parent instead of a dict per text
+    scores = np.full((len(texts), len(lexicon.categories)), np.nan, dtype=np.float32)
+    for i, words in enumerate(filter_texts(texts, backend=_worker['backend'], n_process=1)):
+        if words:
+            scores[i] = lexicon.jargon_scores(lexicon.lookup(set(words)), threshold, weighted) / len(words)
+    return scores
+
+
+def _chunks(texts, categories, chunk_size, threshold, weighted):
+    texts = iter(texts)
+    categories = iter(categories)
+    while chunk := list(islice(texts, chunk_size)):
+        yield chunk, list(islice(categories, len(chunk))), threshold, weighted
+
+
+def _pool(shared: SharedLexicon, n_workers: int, backend: str) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=n_workers or os.cpu_count(), initializer=_init_worker,
+                               initargs=(shared.shm.name, shared.layout, backend or DEFAULT_BACKEND))
+
+
+def calculate_jargon_metric_parallel(texts, categories, threshold: float = 0.1, weighted: bool = False,
+                                     n_workers: int = None, chunk_size: int = 10_000, backend: str = None):
+    """
+    calculate_jargon_metric_batch split over a process pool. Every worker loads the tokenizer once and
+    attaches to the lexicon in shared memory.
+    :param texts: Iterable of texts
+    :param categories: Iterable aligned with texts, holding the related categories of each text (or None)
+    :param n_workers: Number of worker processes, all cores by default
+    :param chunk_size: Number of texts sent to a worker at a time
+    :return: A list with one jargon proportion dict per text, in input order
+    """
+    with SharedLexicon() as shared, _pool(shared, n_workers, backend) as pool:
+        results = pool.map(_score_chunk, _chunks(texts, categories, chunk_size, threshold, weighted))
+        return [proportions for chunk in results for proportions in chunk]
+
+
+def score_files_parallel(paths: [str], text_column: str = 'title', threshold: float = 0.1, weighted: bool = False,
+                         n_workers: int = None, backend: str = None):
+    """
+    Score every text of every file (e.g. the monthly r/science CSVs) against all categories,
+    with one file per task.
+    :return: The category names, and a dict from path to a float32 (n_texts, n_categories) array with the jargon
+             proportions of the file in input order. Texts without words have a row of NaN.
+             See proportion_dicts for the dicts of calculate_jargon_metric_batch.
+    """
+    with SharedLexicon() as shared, _pool(shared, n_workers, backend) as pool:
+        tasks = [(path, text_column, threshold, weighted) for path in paths]
+        return shared.categories, dict(zip(paths, pool.map(_score_file, tasks)))
+
+
+def proportion_dicts(scores: np.ndarray, categories: [str]) -> list:
+    """
+    The jargon proportion dicts of a score array of score_files_parallel, one per text
+    """
+    empty = np.isnan(scores).all(axis=1)
+    return [{"NONE": 0} if is_empty else dict(zip(categories, row.tolist())) for row, is_empty in zip(scores, empty)]
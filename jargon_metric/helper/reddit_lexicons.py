@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+import constants
+
+MANIFEST = '.manifest.json'
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(output_folder: str) -> dict:
+    path = os.path.join(output_folder, MANIFEST)
+    if not os.path.exists(path):
+        return {'threshold': None, 'files': {}, 'flairs': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(output_folder: str, manifest: dict):
+    path = os.path.join(output_folder, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def source_hashes(category_folder: str, subfields, known_files: dict) -> dict:
+    """
+    Hash every subfield CSV, reusing the manifest hash when mtime and size did not change
+    """
+    files = {}
+    for subfield in subfields:
+        stat = os.stat(os.path.join(category_folder, subfield))
+        known = known_files.get(subfield)
+        if known and known['mtime'] == stat.st_mtime and known['size'] == stat.st_size:
+            files[subfield] = known
+        else:
+            files[subfield] = {'mtime': stat.st_mtime, 'size': stat.st_size,
+                               'sha256': file_hash(os.path.join(category_folder, subfield))}
+    return files
+
+
+def build_flair_lexicons(mapping_file: str, category_folder: str, output_folder: str, threshold: float = 0.1,
+                         force: bool = False) -> [str]:
+    """
+    Write the jargon words (PMI > threshold) of every flair to output_folder/<flair>.
+    Only flairs whose subfield CSVs or mapping entry changed since the last build are rebuilt.
+    :return: The flairs that were rebuilt
+    """
+    with open(mapping_file) as f:
+        reddit_to_csv_categories = json.load(f)
+    os.makedirs(output_folder, exist_ok=True)
+
+    manifest = load_manifest(output_folder)
+    if manifest['threshold'] != threshold:
+        force = True
+    subfields = sorted({subfield for fields in reddit_to_csv_categories.values() for subfield in fields})
+    files = source_hashes(category_folder, subfields, manifest['files'])
+
+    jargon_words_per_subfield = {}
+
+    def subfield_jargon_words(subfield):
+        if subfield not in jargon_words_per_subfield:
+            df = pd.read_csv(os.path.join(category_folder, subfield), usecols=['word', 'pmi'])
+            jargon_words_per_subfield[subfield] = df.loc[df['pmi'] > threshold, 'word']
+        return jargon_words_per_subfield[subfield]
+
+    rebuilt = []
+    flairs = {}
+    for category, fields in reddit_to_csv_categories.items():
+        sources = {subfield: files[subfield]['sha256'] for subfield in fields}
+        output_path = os.path.join(output_folder, category)
+        previous = manifest['flairs'].get(category)
+        if force or previous is None or previous['sources'] != sources or previous['subfields'] != fields \
+                or not os.path.exists(output_path):
+            words = [subfield_jargon_words(subfield) for subfield in fields]
+            words = pd.unique(pd.concat(words, ignore_index=True)) if words else []
+            pd.DataFrame(words).to_csv(output_path, index=False)
+            rebuilt.append(category)
+            print(f"Rebuilt {category} ({len(words)} words)")
+        flairs[category] = {'subfields': fields, 'sources': sources}
+
+    # Remove the lexicons of flairs that are no longer in the mapping
+    for category in set(manifest['flairs']) - set(flairs):
+        output_path = os.path.join(output_folder, category)
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        print(f"Removed {category}")
+
+    save_manifest(output_folder, {'threshold': threshold, 'files': files, 'flairs': flairs})
+    print(f"Rebuilt {len(rebuilt)} of {len(flairs)} flairs")
+    return rebuilt
+
+
+if __name__ == "__main__":
+    build_flair_lexicons(constants.REDDIT_TO_CSV_CATEGORIES, constants.CATEGORY, constants.REDDIT_CATEGORIES_PMI)
+
+    print("Done!")
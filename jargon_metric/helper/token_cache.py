@@ -0,0 +1,122 @@
+import hashlib
+import sqlite3
+from array import array
+from itertools import islice
+
+import constants
+from nlp_loader import DEFAULT_BACKEND, filter_texts, get_stop_words
+
+# Number of texts looked up (and tokenized on a miss) at a time
+CHUNK_SIZE = 50_000
+# SQLite limits the number of parameters of a single statement
+_MAX_PARAMETERS = 500
+
+
+class TokenCache:
+    """
+    On-disk cache of filtered token lists, keyed by a hash of (text, tokenizer backend, stop-word list).
+    Tokens are stored as uint32 ids into a token table. When more than max_entries texts are cached,
+    the least recently used entries are evicted.
+    """
+
+    def __init__(self, path: str = constants.TOKEN_CACHE, max_entries: int = 10_000_000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._connection = sqlite3.connect(path)
+        self._connection.executescript('''
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS tokens (id INTEGER PRIMARY KEY, token TEXT UNIQUE NOT NULL);
+            CREATE TABLE IF NOT EXISTS entries (key BLOB PRIMARY KEY, ids BLOB NOT NULL, last_used INTEGER NOT NULL);
+            CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+        ''')
+        self._tokens = [token for token, in self._connection.execute('SELECT token FROM tokens ORDER BY id')]
+        self._token_ids = {token: i for i, token in enumerate(self._tokens)}
+        self._size, clock = self._connection.execute('SELECT COUNT(*), MAX(last_used) FROM entries').fetchone()
+        self._clock = clock or 0
+        self._stop_words_fingerprint = hashlib.sha1('\n'.join(sorted(get_stop_words())).encode()).hexdigest()
+
+    def key(self, text: str, backend: str) -> bytes:
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{backend}\0{self._stop_words_fingerprint}\0{text}".encode('utf-8'))
+        return digest.digest()
+
+    def _encode(self, words: [str]) -> bytes:
+        new_tokens = [word for word in dict.fromkeys(words) if word not in self._token_ids]
+        for token in new_tokens:
+            self._token_ids[token] = len(self._tokens)
+            self._tokens.append(token)
+        if new_tokens:
+            self._connection.executemany('INSERT INTO tokens (id, token) VALUES (?, ?)',
+                                         ((self._token_ids[token], token) for token in new_tokens))
+        return array('I', (self._token_ids[word] for word in words)).tobytes()
+
+    def _decode(self, ids: bytes) -> [str]:
+        tokens = array('I')
+        tokens.frombytes(ids)
+        return [self._tokens[i] for i in tokens]
+
+    def get_many(self, keys: [bytes]) -> list:
+        """
+        Cached token lists of the keys, None for every key that is not cached
+        """
+        found = {}
+        for start in range(0, len(keys), _MAX_PARAMETERS):
+            batch = keys[start:start + _MAX_PARAMETERS]
+            placeholders = ','.join('?' * len(batch))
+            found.update(self._connection.execute(
+                f'SELECT key, ids FROM entries WHERE key IN ({placeholders})', batch))
+        if found:
+            self._clock += 1
+            self._connection.executemany('UPDATE entries SET last_used = ? WHERE key = ?',
+                                         ((self._clock, key) for key in found))
+        # Per key, a text repeated in the chunk is a hit every time it is served from the cache
+        hits = sum(key in found for key in keys)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return [self._decode(found[key]) if key in found else None for key in keys]
+
+    def put_many(self, items):
+        """
+        Cache (key, token list) pairs and evict the least recently used entries above max_entries
+        """
+        self._clock += 1
+        rows = [(key, self._encode(words), self._clock) for key, words in items]
+        cursor = self._connection.executemany(
+            'INSERT OR IGNORE INTO entries (key, ids, last_used) VALUES (?, ?, ?)', rows)
+        self._size += cursor.rowcount
+        if self._size > self.max_entries:
+            self._connection.execute(
+                'DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_used LIMIT ?)',
+                (self._size - self.max_entries,))
+            self._size = self.max_entries
+        self._connection.commit()
+
+    def filter_texts(self, texts, backend: str = None, batch_size: int = 1000, n_process: int = 1):
+        """
+        Same as nlp_loader.filter_texts, but only the texts that are not cached go through the tokenizer
+        """
+        backend = backend or DEFAULT_BACKEND
+        texts = iter(texts)
+        while chunk := list(islice(texts, CHUNK_SIZE)):
+            keys = [self.key(text, backend) for text in chunk]
+            words_per_text = self.get_many(keys)
+            missing = [i for i, words in enumerate(words_per_text) if words is None]
+            if missing:
+                tokenized = filter_texts((chunk[i] for i in missing), backend=backend, batch_size=batch_size,
+                                         n_process=n_process)
+                for i, words in zip(missing, tokenized):
+                    words_per_text[i] = words
+                self.put_many((keys[i], words_per_text[i]) for i in missing)
+            else:
+                self._connection.commit()
+            yield from words_per_text
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': self._size, 'tokens': len(self._tokens)}
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
@@ -0,0 +1,53 @@
+import sys
+
+import numpy as np
+import pandas as pd
+import constants
+from jargon_proportions import calculate_jargon_metric_batch
+from lexicon_store import open_lexicon
+from nlp_loader import filter_texts
+
+
+def parity_report(texts: [str], backends=('blank', 'regex'), reference: str = 'spacy', threshold: float = 0.1):
+    """
+    Compare the tokens and jargon proportions of the tokenizer backends against the reference backend.
+    :param texts: Sample of texts to compare on
+    :param backends: The backends to compare
+    :param reference: The backend used as ground truth, the full spaCy model by default
+    :param threshold: The PMI threshold of the lexicon
+    :return: DataFrame with one row of parity statistics per backend
+    """
+    texts = list(texts)
+    categories = [open_lexicon(constants.LEXICON).categories] * len(texts)
+
+    def run(backend):
+        words = list(filter_texts(texts, backend=backend))
+        proportions = calculate_jargon_metric_batch(texts, categories, threshold=threshold, backend=backend)
+        return words, pd.DataFrame(proportions).drop(columns='NONE', errors='ignore').fillna(0)
+
+    reference_words, reference_proportions = run(reference)
+    rows = []
+    for backend in backends:
+        words, proportions = run(backend)
+        proportions = proportions.reindex_like(reference_proportions).fillna(0)
+        difference = (proportions - reference_proportions).abs().to_numpy()
+        top_category_match = (proportions.to_numpy().argmax(axis=1) ==
+                              reference_proportions.to_numpy().argmax(axis=1))
+        rows.append({
+            'backend': backend,
+            'identical_tokens': np.mean([a == b for a, b in zip(words, reference_words)]),
+            'mean_abs_difference': difference.mean(),
+            'max_abs_difference': difference.max(),
+            'identical_proportions': np.mean((difference == 0).all(axis=1)),
+            'top_category_match': top_category_match.mean(),
+        })
+    return pd.DataFrame(rows).set_index('backend')
+
+
+if __name__ == "__main__":
+    # Usage: python tokenizer_parity.py <csv with a title column> [sample size]
+    sample_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    titles = pd.read_csv(sys.argv[1])['title'].dropna()
+    sample = titles.sample(min(sample_size, len(titles)), random_state=0)
+    print(parity_report(sample))
+    print("Done!")
@@ -1,10 +1,14 @@
 import json
+import os
+import sys
 from collections import defaultdict
 from functools import partial
 
+import numpy as np
 import pandas as pd
-from datasets import load_dataset, Dataset, DatasetDict, Value
-from tqdm import tqdm
+import pyarrow.compute as pc
+from datasets import load_dataset, Dataset, DatasetDict, Features, Sequence, Value
+from tokenizers import Tokenizer
 
 
 class LabelPassthrough(object):
@@ -41,6 +45,9 @@ GENERALIZATION_LABEL_MAP = {
 
 SENSATIONALISM_LABEL_MAP = LabelPassthrough()
 
+# Columns of the generalization pair datasets, the sentences are rows of the sentence table
+PAIR_COLUMNS = ('article_id', 'text_id', 'text_pair_id')
+
 TASK_ID_MAP = {
     'causality': CAUSAILTY_LABEL_MAP,
     'certainty': CERTAINTY_LABEL_MAP,
@@ -137,53 +144,190 @@ def load_dataset_from_directory(dir, tokenizer, task='causality', use_regression
                        remove_columns=column_names), testset, label_map
 
 
-def load_inference_dataset(data_jsonl, task='causality'):
-    paper_dataset = defaultdict(list)
-    news_dataset = defaultdict(list)
-    tweet_dataset = defaultdict(list)
-
-    original_data = []
-    with open(data_jsonl) as f:
-        for l in tqdm(f):
-            data = json.loads(l)
-            original_data.append(data)
-
-            if task != 'generalization':
-                # Load paper sentences
-                for j, sentence in enumerate(data['paper_sentences']):
-                    paper_dataset['article_id'].append(f"{data['doi']}_{j}")
-                    paper_dataset['text'].append(sentence)
-
-                # Load news sentences
-                for news in data['news']:
-                    if 'finding_sentences' in data['news'][news]:
-                        for j, sentence in enumerate(data['news'][news]['finding_sentences']):
-                            news_dataset['article_id'].append(f"{news}_{j}")
-                            news_dataset['text'].append(sentence['text'])
-
-                # Load tweets
-                for j, tweet in enumerate(data['full_tweets']):
-                    tdata = json.loads(tweet['tweet'])
-                    tweet_dataset['article_id'].append(f"{data['doi']}_{j}")
-                    tweet_dataset['text'].append(tdata['text'])
-            else:
-                # Load news sentences
-                for news in data['news']:
-                    if 'finding_sentences' in data['news'][news]:
-                        for j, news_sentence in enumerate(data['news'][news]['finding_sentences']):
-                            for k, paper_sentence in enumerate(data['paper_sentences']):
-                                if news_sentence['paper_sentence_scores'][k] >= 3:
-                                    news_dataset['article_id'].append(f"{news}_{j}_{k}")
-                                    news_dataset['text'].append(
-                                        {'text': paper_sentence, 'text_pair': news_sentence['text']})
-
-                # Load tweets
-                for j, tweet in enumerate(data['full_tweets']):
-                    for k, paper_sentence in enumerate(data['paper_sentences']):
-                        if tweet['paper_sentence_scores'][k] >= 3:
-                            tdata = json.loads(tweet['tweet'])
-                            tweet_dataset['article_id'].append(f"{data['doi']}_{j}_{k}")
-                            tweet_dataset['text'].append({'text': paper_sentence, 'text_pair': tdata['text']})
-
-    return Dataset.from_dict(paper_dataset), Dataset.from_dict(news_dataset), Dataset.from_dict(
-        tweet_dataset), original_data
+def jsonl_shards(data_jsonl, num_shards):
+    """
+    Split a JSONL file into num_shards byte ranges, a line belongs to the range its first byte is in
+    """
+    size = os.path.getsize(data_jsonl)
+    return [(data_jsonl, size * i // num_shards, size * (i + 1) // num_shards) for i in range(num_shards)]
+
+
+def read_jsonl_range(data_jsonl, start, end):
+    """
+    Parse the lines of a JSONL file that start in [start, end)
+    """
+    with open(data_jsonl, 'rb') as f:
+        if start > 0:
+            # Skip the line that started in the previous range
+            f.seek(start - 1)
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            if line.strip():
+                yield json.loads(line)
+
+
+def _inference_examples(shards, modified):
+    # One row per paper sentence, news sentence or tweet, split into datasets by source afterwards.
+    # modified only changes the fingerprint of the generator, so an updated file is not read from the cache.
+    for data_jsonl, start, end in shards:
+        for data in read_jsonl_range(data_jsonl, start, end):
+            # Load paper sentences
+            for j, sentence in enumerate(data['paper_sentences']):
+                yield {'source': 'paper', 'article_id': f"{data['doi']}_{j}", 'text': sentence}
+
+            # Load news sentences
+            for news in data['news']:
+                if 'finding_sentences' in data['news'][news]:
+                    for j, sentence in enumerate(data['news'][news]['finding_sentences']):
+                        yield {'source': 'news', 'article_id': f"{news}_{j}", 'text': sentence['text']}
+
+            # Load tweets
+            for j, tweet in enumerate(data['full_tweets']):
+                tdata = json.loads(tweet['tweet'])
+                yield {'source': 'tweet', 'article_id': f"{data['doi']}_{j}", 'text': tdata['text']}
+
+
+def _matching_pairs(findings, n_paper):
+    # (finding, paper sentence) index pairs with a paper_sentence_scores of at least 3, in row-major order
+    scores = np.array([finding['paper_sentence_scores'][:n_paper] for finding in findings], dtype=float)
+    return np.nonzero(scores.reshape(len(findings), n_paper) >= 3)
+
+
+def _generalization_articles(shards, modified):
+    # One row per record: its unique sentences, and the (paper sentence, finding) pairs as indices into them
+    for data_jsonl, start, end in shards:
+        for data in read_jsonl_range(data_jsonl, start, end):
+            sentence_ids = {}
+            paper_ids = np.array([sentence_ids.setdefault(sentence, len(sentence_ids))
+                                  for sentence in data['paper_sentences']], dtype=np.int64)
+            row = {'sentences': None, 'news_article_id': [], 'news_text_id': [], 'news_text_pair_id': []}
+
+            # Load news sentence pairs
+            for news in data['news']:
+                findings = data['news'][news].get('finding_sentences', [])
+                j, k = _matching_pairs(findings, len(paper_ids))
+                finding_ids = np.array([sentence_ids.setdefault(finding['text'], len(sentence_ids))
+                                        for finding in findings], dtype=np.int64)
+                row['news_article_id'] += [f"{news}_{a}_{b}" for a, b in zip(j.tolist(), k.tolist())]
+                row['news_text_id'] += paper_ids[k].tolist()
+                row['news_text_pair_id'] += finding_ids[j].tolist()
+
+            # Load tweet pairs, only tweets with a matching paper sentence are decoded
+            j, k = _matching_pairs(data['full_tweets'], len(paper_ids))
+            tweet_ids = {}
+            for t in np.unique(j).tolist():
+                text = json.loads(data['full_tweets'][t]['tweet'])['text']
+                tweet_ids[t] = sentence_ids.setdefault(text, len(sentence_ids))
+            row['tweet_article_id'] = [f"{data['doi']}_{a}_{b}" for a, b in zip(j.tolist(), k.tolist())]
+            row['tweet_text_id'] = paper_ids[k].tolist()
+            row['tweet_text_pair_id'] = [tweet_ids[t] for t in j.tolist()]
+
+            row['sentences'] = list(sentence_ids)
+            yield row
+
+
+def _flatten_sentences(batch):
+    return {'text': [sentence for sentences in batch['sentences'] for sentence in sentences]}
+
+
+def _flatten_pairs(batch, indices, offsets, source):
+    # Shift the sentence indices of every record by the position of its first sentence in the sentence table
+    flat = {'article_id': [article_id for ids in batch[f"{source}_article_id"] for article_id in ids]}
+    for column in ('text_id', 'text_pair_id'):
+        flat[column] = [offsets[i] + index for i, ids in zip(indices, batch[f"{source}_{column}"]) for index in ids]
+    return flat
+
+
+def _load_generalization_pairs(data_jsonl, num_proc, num_shards, cache_dir):
+    ids = Sequence(Value('int64'))
+    features = Features({'sentences': Sequence(Value('string')),
+                         **{f"{source}_{column}": Sequence(Value('string')) if column == 'article_id' else ids
+                            for source in ('news', 'tweet') for column in PAIR_COLUMNS}})
+    articles = Dataset.from_generator(_generalization_articles, features=features, cache_dir=cache_dir,
+                                      gen_kwargs={'shards': jsonl_shards(data_jsonl, num_shards or num_proc or 1),
+                                                  'modified': os.stat(data_jsonl).st_mtime_ns},
+                                      num_proc=num_proc if num_proc and num_proc > 1 else None)
+
+    counts = pc.list_value_length(articles.data.column('sentences')).to_numpy(zero_copy_only=False)
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]]).tolist()
+    sentences = articles.map(_flatten_sentences, batched=True, remove_columns=articles.column_names,
+                             num_proc=num_proc)
+    news_pairs, tweet_pairs = [articles.map(_flatten_pairs, batched=True, with_indices=True, num_proc=num_proc,
+                                            fn_kwargs={'offsets': offsets, 'source': source},
+                                            remove_columns=articles.column_names)
+                               for source in ('news', 'tweet')]
+    return sentences, news_pairs, tweet_pairs
+
+
+def _encode_pairs(batch, sentences, tokenizer, encoder, assembler):
+    # Every sentence of the batch is tokenized once, the pairs are assembled from the encodings
+    ids = np.unique(batch['text_id'] + batch['text_pair_id']).tolist()
+    texts = sentences[ids]['text']
+    if encoder is None:
+        lookup = dict(zip(ids, texts))
+        return tokenizer([lookup[i] for i in batch['text_id']], [lookup[i] for i in batch['text_pair_id']],
+                         truncation=True)
+    encodings = dict(zip(ids, encoder.encode_batch(texts, add_special_tokens=False)))
+    pairs = [assembler.post_process(encodings[a], encodings[b], add_special_tokens=True)
+             for a, b in zip(batch['text_id'], batch['text_pair_id'])]
+    encoded = {'input_ids': [pair.ids for pair in pairs],
+               'token_type_ids': [pair.type_ids for pair in pairs],
+               'attention_mask': [pair.attention_mask for pair in pairs]}
+    return {name: values for name, values in encoded.items() if name in tokenizer.model_input_names}
+
+
+def tokenize_pairs(sentences, pairs, tokenizer, num_proc=None):
+    """
+    Tokenize the generalization pairs of load_inference_dataset like preprocess_data does with text and text_pair,
+    but from the sentence table, so a paper sentence shared by many pairs is not tokenized for every pair
+    """
+    encoder = assembler = None
+    if getattr(tokenizer, 'is_fast', False):
+        # Two copies of the backend: the sentences are encoded whole, and only the assembled pair is truncated like
+        # tokenizer(..., truncation=True). Truncating the single sentences first changes the longest_first split.
+        encoder = Tokenizer.from_str(tokenizer.backend_tokenizer.to_str())
+        encoder.no_padding()
+        encoder.no_truncation()
+        assembler = Tokenizer.from_str(tokenizer.backend_tokenizer.to_str())
+        assembler.no_padding()
+        # model_max_length is a huge placeholder for tokenizers without a limit
+        assembler.enable_truncation(min(tokenizer.model_max_length, sys.maxsize), strategy='longest_first')
+    return pairs.map(_encode_pairs, batched=True, num_proc=num_proc, remove_columns=['text_id', 'text_pair_id'],
+                     fn_kwargs={'sentences': sentences, 'tokenizer': tokenizer, 'encoder': encoder,
+                                'assembler': assembler})
+
+
+def load_inference_dataset(data_jsonl, task='causality', keep_original=False, num_proc=None, num_shards=None,
+                           cache_dir=None):
+    """
+    Load the paper sentences, news sentences and tweets of a JSONL file as Arrow datasets. Records are streamed
+    and parsed once, the rows are written to the datasets cache on disk instead of being held in memory.
+    For generalization the first dataset is a table of the unique sentences of every record, and the news and
+    tweet datasets hold (paper sentence, finding) pairs as text_id and text_pair_id rows of that table, see
+    tokenize_pairs.
+    :param keep_original: Also return the parsed records as a list, None otherwise
+    :param num_proc: Processes that read byte ranges of the file in parallel
+    :param num_shards: Byte ranges to split the file into, num_proc by default
+    :return: The paper (or sentence), news and tweet datasets and the original records
+    """
+    original_data = None
+    if keep_original:
+        with open(data_jsonl) as f:
+            original_data = [json.loads(l) for l in f if l.strip()]
+    if task == 'generalization':
+        return (*_load_generalization_pairs(data_jsonl, num_proc, num_shards, cache_dir), original_data)
+
+    features = Features({'source': Value('string'), 'article_id': Value('string'), 'text': Value('string')})
+    dataset = Dataset.from_generator(_inference_examples, features=features, cache_dir=cache_dir,
+                                     gen_kwargs={'shards': jsonl_shards(data_jsonl, num_shards or num_proc or 1),
+                                                 'modified': os.stat(data_jsonl).st_mtime_ns},
+                                     num_proc=num_proc if num_proc and num_proc > 1 else None)
+
+    datasets = []
+    for source in ('paper', 'news', 'tweet'):
+        datasets.append(dataset.filter(lambda sources: [s == source for s in sources], input_columns='source',
+                                       batched=True, num_proc=num_proc).remove_columns('source'))
+    return datasets[0], datasets[1], datasets[2], original_data
@@ -0,0 +1,181 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from transformers import AutoTokenizer
+
+
+def configure_threads(num_threads=None):
+    """
+    Use num_threads (all cores by default) for the intra-op parallelism of a single forward pass and one
+    inter-op thread, batches are run one after the other anyway
+    """
+    import torch
+
+    torch.set_num_threads(num_threads or os.cpu_count())
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Can only be set before the first parallel work
+        pass
+
+
+def pipeline_function(config) -> str:
+    """
+    The function the text-classification pipeline applies to the logits of a model with this config by default
+    """
+    if config.problem_type == "regression":
+        return "none"
+    if config.problem_type == "multi_label_classification" or config.num_labels == 1:
+        return "sigmoid"
+    return "softmax"
+
+
+def postprocess(logits: np.ndarray, function: str) -> (np.ndarray, np.ndarray):
+    """
+    Top-1 score and label id per row, like pipe(text)[0]["score"] and ["label"]
+    """
+    if function == "sigmoid":
+        outputs = 1 / (1 + np.exp(-logits))
+    elif function == "softmax":
+        shifted = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        outputs = shifted / shifted.sum(axis=-1, keepdims=True)
+    else:
+        outputs = logits
+    labels = outputs.argmax(axis=-1)
+    return outputs[np.arange(len(outputs)), labels], labels
+
+
+class TextClassifier:
+    """
+    Batched CPU inference for a sequence classification model. Texts are tokenized once, sorted by token length
+    and padded per batch only, so short titles are not padded to max_length. The scores match the
+    text-classification pipeline.
+    """
+    # Tensor type of the padded batches passed to _forward
+    return_tensors = "pt"
+
+    def __init__(self, model_dir: str, max_length: int = 512, batch_size: int = 64, num_threads: int = None,
+                 function_to_apply: str = None):
+        from transformers import AutoModelForSequenceClassification
+
+        configure_threads(num_threads)
+        self.model = AutoModelForSequenceClassification.from_pretrained(model_dir).eval()
+        self._setup(model_dir, self.model.config, max_length, batch_size, function_to_apply)
+
+    def _setup(self, model_dir: str, config, max_length: int, batch_size: int, function_to_apply: str):
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.config = config
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.function = function_to_apply or pipeline_function(config)
+
+    def _forward(self, inputs) -> np.ndarray:
+        import torch
+
+        with torch.inference_mode():
+            return self.model(**inputs).logits.float().numpy()
+
+    def encode(self, texts: [str], text_pairs: [str] = None):
+        """
+        Tokenize all texts once, without padding
+        :return: The encodings and the text indices sorted by token length
+        """
+        encodings = self.tokenizer(texts, text_pairs, truncation=True, max_length=self.max_length)
+        lengths = np.fromiter(map(len, encodings["input_ids"]), dtype=np.int64, count=len(texts))
+        return encodings, np.argsort(lengths, kind="stable")
+
+    def batches(self, encodings, order: np.ndarray):
+        """
+        Yield the text indices of every batch and their inputs, padded to the longest text of the batch
+        """
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            features = {key: [values[i] for i in batch] for key, values in encodings.items()}
+            yield batch, self.tokenizer.pad(features, return_tensors=self.return_tensors)
+
+    def logits(self, texts: [str], text_pairs: [str] = None) -> np.ndarray:
+        logits = np.empty((len(texts), self.config.num_labels), dtype=np.float32)
+        for batch, inputs in self.batches(*self.encode(texts, text_pairs)):
+            logits[batch] = self._forward(inputs)
+        return logits
+
+    def score(self, texts: [str], text_pairs: [str] = None) -> np.ndarray:
+        """
+        Top-1 pipeline score of every text (pair)
+        """
+        if len(texts) == 0:
+            return np.empty(0, dtype=np.float32)
+        scores, _ = postprocess(self.logits(texts, text_pairs), self.function)
+        return scores
+
+
+def score_file(classifier: TextClassifier, input_file: str, output_file: str, text_column: str = "title",
+               score_column: str = "sensationalism_score", chunksize: int = 50_000) -> (int, float):
+    """
+    Score a CSV chunk by chunk and stream the chunks to output_file, which only appears once it is complete
+    :return: The number of scored titles and the seconds it took
+    """
+    n = 0
+    started = time.perf_counter()
+    tmp_file = output_file + ".tmp"
+    for i, df in enumerate(pd.read_csv(input_file, chunksize=chunksize)):
+        df[score_column] = classifier.score(df[text_column].fillna("").astype(str).tolist())
+        df.to_csv(tmp_file, mode="w" if i == 0 else "a", header=i == 0)
+        n += len(df)
+    os.replace(tmp_file, output_file)
+    return n, time.perf_counter() - started
+
+
+def score_months(classifier: TextClassifier, data_dir: str, output_dir: str, text_column: str = "title"):
+    """
+    Score every monthly CSV of data_dir into output_dir, skipping files that were already scored
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    filenames = sorted(filename for filename in os.listdir(data_dir) if filename.endswith(".csv"))
+    total, seconds = 0, 0.0
+    for i, filename in enumerate(filenames, 1):
+        output_file = os.path.join(output_dir, filename[:-4] + "_sensationalism_score.csv")
+        if os.path.exists(output_file):
+            print(f"Skipping {filename} - already processed.")
+            continue
+        n, elapsed = score_file(classifier, os.path.join(data_dir, filename), output_file, text_column)
+        total, seconds = total + n, seconds + elapsed
+        print(f"{filename} ({i} out of {len(filenames)}): {n} titles, {n / elapsed:.1f} titles/s")
+    if seconds:
+        print(f"Total: {total} titles, {total / seconds:.1f} titles/s")
+
+
+def benchmark(classifier: TextClassifier, titles: [str]) -> float:
+    """
+    Titles per second, including tokenization
+    """
+    started = time.perf_counter()
+    classifier.score(titles)
+    return len(titles) / (time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batched CPU sensationalism scoring of monthly reddit files")
+    parser.add_argument("model", help="Folder with the sensationalism model")
+    parser.add_argument("data_dir", help="Folder with the monthly CSV files")
+    parser.add_argument("output_dir")
+    parser.add_argument("--text-column", default="title")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--max-length", type=int, default=512)
+    parser.add_argument("--threads", type=int, help="Intra-op threads (default: all cores)")
+    parser.add_argument("--benchmark", type=int, metavar="N",
+                        help="Only report titles/s on the first N titles of the first file")
+    args = parser.parse_args()
+
+    classifier = TextClassifier(args.model, args.max_length, args.batch_size, args.threads)
+    if args.benchmark:
+        first = sorted(filename for filename in os.listdir(args.data_dir) if filename.endswith(".csv"))[0]
+        titles = pd.read_csv(os.path.join(args.data_dir, first), nrows=args.benchmark)[args.text_column]
+        titles = titles.fillna("").astype(str).tolist()
+        print(f"{benchmark(classifier, titles):.1f} titles/s with {args.threads or os.cpu_count()} threads, "
+              f"batch size {args.batch_size}")
+    else:
+        score_months(classifier, args.data_dir, args.output_dir, args.text_column)
@@ -0,0 +1,146 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from datareader import TASK_ID_MAP
+from inference import TextClassifier, postprocess
+from onnx_export import PAIR_TASKS, OnnxTextClassifier
+
+
+def tokenizer_fingerprint(tokenizer, max_length: int) -> str:
+    """
+    Hash of everything that decides the encodings of a tokenizer. Models with the same fingerprint can share
+    one encoded batch.
+    """
+    if getattr(tokenizer, "is_fast", False):
+        # The serialized pipeline covers the normalizer, pre-tokenizer, vocabulary and special tokens
+        state = tokenizer.backend_tokenizer.to_str()
+    else:
+        state = json.dumps(sorted(tokenizer.get_vocab().items()))
+    state += f"{type(tokenizer).__name__}|{tokenizer.padding_side}|{tokenizer.pad_token_id}|{max_length}"
+    return hashlib.sha256(state.encode()).hexdigest()
+
+
+class MultiTaskScorer:
+    """
+    Scores texts with the models of several tasks in one pass. Tasks whose tokenizers match are grouped, each
+    group tokenizes and pads every batch once and feeds it to all of its models.
+    """
+
+    def __init__(self, models_dir: str, tasks: [str] = None, max_length: int = 512, batch_size: int = 64,
+                 num_threads: int = None, onnx: bool = False, quantized: bool = False):
+        """
+        :param models_dir: Folder with a model folder per task (see models/README.md), or with the exported
+                           models of onnx_export.py if onnx
+        :param tasks: Every task of TASK_ID_MAP that has a model folder if not given
+        """
+        self.tasks = tasks or [task for task in TASK_ID_MAP if os.path.isdir(os.path.join(models_dir, task))]
+        self.classifiers = {}
+        for task in self.tasks:
+            model_dir = os.path.join(models_dir, task)
+            if onnx:
+                self.classifiers[task] = OnnxTextClassifier(model_dir, max_length, batch_size, num_threads,
+                                                            quantized=quantized)
+            else:
+                self.classifiers[task] = TextClassifier(model_dir, max_length, batch_size, num_threads)
+
+        # Pair tasks are encoded with their text pair, so they never share a batch with single text tasks
+        self.groups = {}
+        for task, classifier in self.classifiers.items():
+            key = (tokenizer_fingerprint(classifier.tokenizer, max_length), task in PAIR_TASKS)
+            self.groups.setdefault(key, []).append(task)
+        print(f"{len(self.tasks)} tasks in {len(self.groups)} tokenizer groups: {list(self.groups.values())}")
+
+    def score(self, texts: [str], text_pairs: [str] = None) -> pd.DataFrame:
+        """
+        :param text_pairs: The second text of pair tasks (generalization), pair tasks are skipped if not given
+        :return: <task>_score columns with the top-1 pipeline score, and <task>_label columns with the label id
+                 for classification tasks
+        """
+        columns = {}
+        for (_, pair), tasks in self.groups.items():
+            if pair and text_pairs is None:
+                continue
+            classifiers = [self.classifiers[task] for task in tasks]
+            logits = [np.empty((len(texts), classifier.config.num_labels), dtype=np.float32)
+                      for classifier in classifiers]
+            if len(texts):
+                encodings, order = classifiers[0].encode(texts, text_pairs if pair else None)
+                for batch, inputs in classifiers[0].batches(encodings, order):
+                    for classifier, task_logits in zip(classifiers, logits):
+                        task_logits[batch] = classifier._forward(inputs)
+            for task, classifier, task_logits in zip(tasks, classifiers, logits):
+                scores, labels = postprocess(task_logits, classifier.function)
+                columns[f"{task}_score"] = scores
+                if classifier.function == "softmax":
+                    columns[f"{task}_label"] = labels
+        return pd.DataFrame(columns)
+
+
+def score_file(scorer: MultiTaskScorer, input_file: str, output_file: str, text_column: str = "title",
+               text_pair_column: str = None, chunksize: int = 50_000) -> (int, float):
+    """
+    Add the scores of every task as columns to a CSV, chunk by chunk. output_file only appears once it is complete.
+    :return: The number of scored texts and the seconds it took
+    """
+    n = 0
+    started = time.perf_counter()
+    tmp_file = output_file + ".tmp"
+    for i, df in enumerate(pd.read_csv(input_file, chunksize=chunksize)):
+        texts = df[text_column].fillna("").astype(str).tolist()
+        text_pairs = df[text_pair_column].fillna("").astype(str).tolist() if text_pair_column else None
+        scores = scorer.score(texts, text_pairs)
+        for column in scores.columns:
+            df[column] = scores[column].to_numpy()
+        df.to_csv(tmp_file, mode="w" if i == 0 else "a", header=i == 0)
+        n += len(df)
+    os.replace(tmp_file, output_file)
+    return n, time.perf_counter() - started
+
+
+def score_months(scorer: MultiTaskScorer, data_dir: str, output_dir: str, text_column: str = "title",
+                 text_pair_column: str = None):
+    """
+    Score every monthly CSV of data_dir with all tasks into output_dir, skipping files that were already scored
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    filenames = sorted(filename for filename in os.listdir(data_dir) if filename.endswith(".csv"))
+    total, seconds = 0, 0.0
+    for i, filename in enumerate(filenames, 1):
+        output_file = os.path.join(output_dir, filename[:-4] + "_task_scores.csv")
+        if os.path.exists(output_file):
+            print(f"Skipping {filename} - already processed.")
+            continue
+        n, elapsed = score_file(scorer, os.path.join(data_dir, filename), output_file, text_column,
+                                text_pair_column)
+        total, seconds = total + n, seconds + elapsed
+        print(f"{filename} ({i} out of {len(filenames)}): {n} titles, {n / elapsed:.1f} titles/s")
+    if seconds:
+        print(f"Total: {total} titles, {total / seconds:.1f} titles/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score monthly reddit files with all task models in one pass")
+    parser.add_argument("models_dir", help="Folder with a model folder per task, see models/README.md")
+    parser.add_argument("data_dir", help="Folder with the monthly CSV files")
+    parser.add_argument("output_dir")
+    parser.add_argument("--tasks", nargs="+", choices=list(TASK_ID_MAP))
+    parser.add_argument("--text-column", default="title")
+    parser.add_argument("--text-pair-column", help="Second text of the pair tasks (generalization)")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--max-length", type=int, default=512)
+    parser.add_argument("--threads", type=int, help="Intra-op threads (default: all cores)")
+    parser.add_argument("--onnx", action="store_true", help="models_dir holds models exported by onnx_export.py")
+    parser.add_argument("--quantized", action="store_true", help="Use the int8 ONNX models")
+    args = parser.parse_args()
+
+    scorer = MultiTaskScorer(args.models_dir, args.tasks, args.max_length, args.batch_size, args.threads,
+                             args.onnx, args.quantized)
+    if not args.text_pair_column and any(task in PAIR_TASKS for task in scorer.tasks):
+        print(f"No --text-pair-column, skipping {[task for task in scorer.tasks if task in PAIR_TASKS]}")
+    score_months(scorer, args.data_dir, args.output_dir, args.text_column, args.text_pair_column)
@@ -0,0 +1,165 @@
+import argparse
+import inspect
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.stats import spearmanr
+
+from datareader import TASK_ID_MAP
+from inference import TextClassifier, postprocess
+
+ONNX_FILE = "model.onnx"
+QUANTIZED_FILE = "model.int8.onnx"
+OPSET = 17
+# Generalization compares two findings, the other tasks score a single text
+PAIR_TASKS = ('generalization',)
+ANNOTATED_TITLES = "../../data/annotated_w_mean_sensationalism.csv"
+
+
+def export_onnx(model_dir: str, output_dir: str, quantize: bool = False, opset: int = OPSET) -> str:
+    """
+    Export a fine-tuned sequence classification model to ONNX with dynamic batch and sequence axes. The tokenizer
+    and config are saved next to it, so output_dir can be loaded by OnnxTextClassifier on its own.
+    :param quantize: Also write a dynamically int8 quantized copy (weights of the MatMuls in int8)
+    :return: The path of the exported (quantized if requested) model
+    """
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    model = AutoModelForSequenceClassification.from_pretrained(model_dir).eval()
+    # The return_dict output is a ModelOutput, the traced graph only needs the logits
+    model.config.return_dict = False
+
+    dummy = tokenizer(["An example title"], ["An example finding"], return_tensors="pt")
+    # The exporter binds the inputs to forward() and names them by position, so both have to follow the order of
+    # its signature (input_ids, attention_mask, token_type_ids for BERT), not the order of the tokenizer output
+    input_names = [name for name in inspect.signature(model.forward).parameters if name in dummy]
+    dummy = {name: dummy[name] for name in input_names}
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["logits"] = {0: "batch"}
+    kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # dynamic_axes is an argument of the TorchScript exporter
+        kwargs["dynamo"] = False
+
+    onnx_path = os.path.join(output_dir, ONNX_FILE)
+    with torch.inference_mode():
+        torch.onnx.export(model, (dummy,), onnx_path, input_names=input_names, output_names=["logits"],
+                          dynamic_axes=dynamic_axes, opset_version=opset, do_constant_folding=True, **kwargs)
+    model.config.return_dict = True
+    model.config.save_pretrained(output_dir)
+    tokenizer.save_pretrained(output_dir)
+    print(f"Exported {model_dir} to {onnx_path}")
+
+    if not quantize:
+        return onnx_path
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantized_path = os.path.join(output_dir, QUANTIZED_FILE)
+    quantize_dynamic(onnx_path, quantized_path, weight_type=QuantType.QInt8)
+    print(f"Quantized {onnx_path} to {quantized_path}")
+    return quantized_path
+
+
+def export_tasks(models_dir: str, output_dir: str, tasks: [str] = None, quantize: bool = False) -> dict:
+    """
+    Export the models of models_dir/<task> (see models/README.md) to output_dir/<task>
+    :param tasks: The tasks to export, every task of TASK_ID_MAP that has a model folder if not given
+    :return: The exported model path by task
+    """
+    tasks = tasks or [task for task in TASK_ID_MAP if os.path.isdir(os.path.join(models_dir, task))]
+    return {task: export_onnx(os.path.join(models_dir, task), os.path.join(output_dir, task), quantize)
+            for task in tasks}
+
+
+class OnnxTextClassifier(TextClassifier):
+    """
+    Drop-in replacement for TextClassifier that runs an exported model with ONNX Runtime, with the same
+    length-sorted batching and pipeline scores. Does not need torch.
+    """
+    return_tensors = "np"
+
+    def __init__(self, model_dir: str, max_length: int = 512, batch_size: int = 64, num_threads: int = None,
+                 function_to_apply: str = None, quantized: bool = False):
+        import onnxruntime as ort
+        from transformers import AutoConfig
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads or os.cpu_count()
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        model_path = os.path.join(model_dir, QUANTIZED_FILE if quantized else ONNX_FILE)
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+        self._setup(model_dir, AutoConfig.from_pretrained(model_dir), max_length, batch_size, function_to_apply)
+
+    def _forward(self, inputs) -> np.ndarray:
+        feed = {name: inputs[name].astype(np.int64) for name in self.input_names}
+        return self.session.run(["logits"], feed)[0].astype(np.float32)
+
+
+def _timed_logits(classifier: TextClassifier, texts: [str], text_pairs: [str] = None) -> (np.ndarray, float):
+    started = time.perf_counter()
+    logits = classifier.logits(texts, text_pairs)
+    return logits, len(texts) / (time.perf_counter() - started)
+
+
+def parity_report(reference: TextClassifier, candidate: TextClassifier, texts: [str],
+                  text_pairs: [str] = None) -> dict:
+    """
+    Compare the pipeline scores of an exported model with the fp32 model it was exported from
+    :return: Score differences, Spearman correlation, top-1 label agreement and the speedup in texts/s
+    """
+    reference_logits, reference_speed = _timed_logits(reference, texts, text_pairs)
+    candidate_logits, candidate_speed = _timed_logits(candidate, texts, text_pairs)
+    reference_scores, reference_labels = postprocess(reference_logits, reference.function)
+    candidate_scores, candidate_labels = postprocess(candidate_logits, candidate.function)
+    differences = np.abs(reference_scores - candidate_scores)
+    return {
+        "n": len(texts),
+        "max_abs_diff": float(differences.max()),
+        "mean_abs_diff": float(differences.mean()),
+        "max_abs_logit_diff": float(np.abs(reference_logits - candidate_logits).max()),
+        "spearman": float(spearmanr(reference_scores, candidate_scores).correlation),
+        "label_agreement": float((reference_labels == candidate_labels).mean()),
+        "fp32_texts_per_second": reference_speed,
+        "onnx_texts_per_second": candidate_speed,
+        "speedup": candidate_speed / reference_speed,
+    }
+
+
+def task_parity(models_dir: str, onnx_dir: str, titles: [str], tasks: [str], quantized: bool = False) -> pd.DataFrame:
+    """
+    Parity report of every exported task model on the titles. Pair models get each title paired with the next one.
+    """
+    reports = {}
+    for task in tasks:
+        text_pairs = titles[1:] + titles[:1] if task in PAIR_TASKS else None
+        reference = TextClassifier(os.path.join(models_dir, task))
+        candidate = OnnxTextClassifier(os.path.join(onnx_dir, task), quantized=quantized)
+        reports[task] = parity_report(reference, candidate, titles, text_pairs)
+        print(f"{task}: {reports[task]}")
+    return pd.DataFrame.from_dict(reports, orient="index")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the sensationalism and SPICED task models to ONNX")
+    parser.add_argument("models_dir", help="Folder with a model folder per task, see models/README.md")
+    parser.add_argument("output_dir")
+    parser.add_argument("--tasks", nargs="+", choices=list(TASK_ID_MAP))
+    parser.add_argument("--quantize", action="store_true", help="Also write a dynamically int8 quantized model")
+    parser.add_argument("--titles", default=ANNOTATED_TITLES, help="CSV with the titles of the parity report")
+    parser.add_argument("--skip-parity", action="store_true")
+    args = parser.parse_args()
+
+    exported = export_tasks(args.models_dir, args.output_dir, args.tasks, args.quantize)
+    if not args.skip_parity:
+        titles = pd.read_csv(args.titles)["title"].fillna("").astype(str).tolist()
+        report = task_parity(args.models_dir, args.output_dir, titles, list(exported), args.quantize)
+        report_path = os.path.join(args.output_dir, "parity.csv")
+        report.to_csv(report_path)
+        print(f"Parity report written to {report_path}")